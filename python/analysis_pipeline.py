@@ -7,17 +7,23 @@ Automated feature and model selection with full pipline nested within loocv
 @author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
 """
 
-import pandas
+import os
 import numpy
 import roc_ci
 import logging
 import functools
+import tempfile
+import fast_loo
+import distributed
+import shared_data
+import result_format
+import content_hash
 import misc_tools as mt
+from pair_cache import PairFitCache
+from fold_store import FoldStore
 #import analysis_utilities as util
-from pickle import dump
 from multiprocessing import Pool
-from sklearn.feature_selection import SelectFromModel
-from sklearn.cross_validation import LeaveOneOut
+from multiprocessing.pool import ThreadPool
 
 # Global constants
 logging.basicConfig( level = logging.DEBUG )
@@ -25,15 +31,71 @@ log = logging.getLogger(__name__)
 log.setLevel( logging.DEBUG )
 
 max_fpr = 0.2 # We are interested in maximizing the TPR only below this FPR
+C_grid = numpy.arange( 0.001, 1.0, 0.001 ) # C values for L1 panel discovery
+slow_methods = ( "rf", "et" ) # Scheduled first so that they do not straggle
+candidate_options = ( "closed_form_nb", "warm_start_linear", "scoring", "precomputed_kernel" ) # selection_options that apply per candidate
 
 # Functions
+
+def new_random_seed():
+    """Random state to record for a fold that is not given one, as returned by
+    numpy.random.get_state, drawn without touching the global numpy RNG (which
+    is shared by threads)."""
+    return ( numpy.random.RandomState().get_state() )
+
+def task_seed( random_seed, *key ):
+    """Seed of the estimators of one task of a fold (its panel discovery, the
+    fits of a candidate, a final fit) from the fold's random_seed and the task's
+    key, so that the task fits the same models whichever worker or thread runs
+    it and in whatever order. None if random_seed is None."""
+    if random_seed is None:
+        return ( None )
+    state = numpy.random.RandomState()
+    state.set_state( random_seed )
+    return ( int( content_hash.digest( state.get_state(), key )[:8], 16 ) )
+
+def candidate_seed( random_seed, panel, method ):
+    return ( task_seed( random_seed, 'candidate', [ int( i ) for i in panel ], method ) )
    
-def get_C_panel( method, features, labels, C ):
-    model = SelectFromModel( method(C).fit( mt.normalize_features( features, normal="scaled" ), labels ), prefit = True )
+def get_C_panel( method, normalized_features, labels, C ):
+    from sklearn.feature_selection import SelectFromModel
+    model = SelectFromModel( method( float( C ) ).fit( normalized_features, labels ), prefit = True )
     return ( model.get_support( True ) )
 
-def filter_C_panels( feature_selection_function, C_range = numpy.nditer( numpy.arange(0.001,1.0,0.001) ), panel_size = 5 ):
-    panels = map( frozenset, map( feature_selection_function, C_range ) )
+def C_path_panels( feature_selection_function, C_range = C_grid, bisection = False, coarse_points = 32 ):
+    """Panels selected along C_range, in increasing order of C.
+
+    By default every point of C_range is fit. With bisection the result is
+    approximate: only a coarse subgrid is fit, refined by bisection between
+    neighbouring points whose panels differ, and points between two that select
+    the same panel are taken to select it too. L1 paths are not monotone, so a
+    panel that only appears between two such points is missed. Each stretch of
+    the path then costs O(log n) fits instead of one per grid point."""
+
+    if not bisection:
+        return ( [ frozenset( feature_selection_function( C ) ) for C in C_range ] )
+
+    panels_at = dict()
+
+    def panel_at( i ):
+        if i not in panels_at:
+            panels_at[i] = frozenset( feature_selection_function( C_range[i] ) )
+        return ( panels_at[i] )
+
+    def bisect( a, b ):
+        if b - a > 1 and panel_at( a ) != panel_at( b ):
+            mid = ( a + b ) // 2
+            bisect( a, mid )
+            bisect( mid, b )
+
+    coarse = numpy.unique( numpy.linspace( 0, len( C_range ) - 1, coarse_points ).astype( int ) )
+    for a, b in zip( coarse[:-1], coarse[1:] ):
+        bisect( a, b )
+
+    return ( [ panels_at[i] for i in sorted( panels_at ) ] )
+
+def filter_C_panels( feature_selection_function, C_range = C_grid, panel_size = 5, bisection = False ):
+    panels = C_path_panels( feature_selection_function, C_range, bisection )
     seen = set()
     return( [panel for panel in panels if len( panel ) == panel_size and not ( panel in seen or seen.add( panel ) ) ] )
 
@@ -41,73 +103,321 @@ def tree_panel( model, panel_size ):
     fs, importances =  zip( *sorted( enumerate( model.feature_importances_ ), key = lambda item: -item[1] ) )
     return( frozenset( fs[0:panel_size] ) )
    
-def get_panel_set( features, labels, panel_size ):
+def get_panel_sets( features, labels, panel_sizes, C_bisection = False, random_state = None ):
+    """Candidate panels for each of panel_sizes from a single C path and a single
+    fit of each tree method, as a dict from panel size to list of sorted panels.
+    With C_bisection the C path is approximate (see C_path_panels). random_state
+    is given to every selector."""
 
-    panels = set()
+    panels = { panel_size: set() for panel_size in panel_sizes }
     
     # Get L1 panels
+    normalized_features = mt.normalize_features( features, normal = "scaled" )
     for method in mt.feature_selection_C_methods:
-        panels.update( filter_C_panels( lambda C : get_C_panel( method, features, labels, C ), panel_size = panel_size ) )
+        selector = lambda C: method( C ).set_params( random_state = random_state )
+        path = C_path_panels( lambda C : get_C_panel( selector, normalized_features, labels, C ), bisection = C_bisection )
+        for panel_size in panel_sizes:
+            panels[ panel_size ].update( panel for panel in path if len( panel ) == panel_size )
     # Get Tree panels
     for method in mt.feature_selection_tree_methods:
-        panels.add( tree_panel( method.fit( mt.normalize_features( features ), labels ), panel_size ) )
-    # Convert to list of lists
-    return ( list( map( list, panels ) ) )
+        model = method().set_params( random_state = random_state ).fit( mt.normalize_features( features ), labels )
+        for panel_size in panel_sizes:
+            panels[ panel_size ].add( tree_panel( model, panel_size ) )
+    # Convert to lists of sorted lists
+    return ( { panel_size: list( map( sorted, panel_set ) ) for panel_size, panel_set in panels.items() } )
+
+def get_panel_set( features, labels, panel_size, C_bisection = False, random_state = None ):
+    return ( get_panel_sets( features, labels, [ panel_size ], C_bisection, random_state )[ panel_size ] )
+
+def iter_inner_loo_scores( panel_features, labels, classifier, ranking = False ):
+    """Generate ( fold, score ) for the inner LOO folds, refitting on each."""
+    from sklearn.cross_validation import LeaveOneOut
+
+    n = len( panel_features )
+
+    for j, (inner_train, inner_test) in enumerate( LeaveOneOut( n ) ):
+
+        normalized_train, normalized_test = mt.normalize_features( panel_features[inner_train], panel_features[inner_test] )
+
+        model = classifier.fit( normalized_train, labels[ inner_train ] )
+
+        yield ( j, mt.model_scores( model, normalized_test, ranking )[0] )
+
+def inner_loo_scores( panel_features, labels, classifier, ranking = False ):
+
+    inner_scores = numpy.zeros( len( panel_features ) )
+    for j, score in iter_inner_loo_scores( panel_features, labels, classifier, ranking ):
+        inner_scores[j] = score
+
+    return ( inner_scores )
+
+def iter_paired_inner_loo_scores( panel_features, labels, classifier, panel_test_features, fit_cache, panel, method, train_ids, test_id, ranking = False ):
+    """Generate ( fold, score ) for the inner LOO folds of outer fold test_id,
+    reusing the fits of other outer folds from fit_cache. Each new fit also
+    scores the outer test sample. The record of the folds done is written to
+    fit_cache when the generator finishes or is closed."""
+    from sklearn.cross_validation import LeaveOneOut
+
+    n = len( panel_features )
+    record = fit_cache.new_record()
+
+    try:
+        for j, (inner_train, inner_test) in enumerate( LeaveOneOut( n ) ):
+
+            partner = train_ids[j]
+            partner_record = fit_cache.get( panel, method, partner )
+
+            if partner_record is not None and not numpy.isnan( partner_record[1, test_id] ):
+                record[0, partner] = partner_record[1, test_id]
+                record[1, partner] = partner_record[0, test_id]
+            else:
+                normalized_train, normalized_test = mt.normalize_features( panel_features[inner_train], numpy.vstack( ( panel_features[inner_test], panel_test_features ) ) )
+
+                model = classifier.fit( normalized_train, labels[ inner_train ] )
+                record[:, partner] = mt.model_scores( model, normalized_test, ranking )
+
+            yield ( j, record[0, partner] )
+    finally:
+        fit_cache.put( panel, method, test_id, record )
+
+def cv_scores( panel_features, labels, classifier, folds, ranking = False ):
+    """Score of each sample from the fit on the fold that holds it out."""
+
+    scores = numpy.zeros( len( panel_features ) )
+
+    for train, test in folds:
+        normalized_train, normalized_test = mt.normalize_features( panel_features[train], panel_features[test] )
+        model = classifier.fit( normalized_train, labels[ train ] )
+        scores[ test ] = mt.model_scores( model, normalized_test, ranking )
 
-def core_pipeline( train_features, train_labels, test_features, test_labels, feature_labels, panel_size, random_seed = None ):
+    return ( scores )
 
-    # save or set seed
-    if random_seed is not None:
-        numpy.random.set_state( random_seed )
+def optimistic_score( inner_scores, scored, labels ):
+    """Upper bound on the final max TPR at FPR <= max_fpr of a candidate, given
+    the inner scores of the scored folds: unscored positives are placed above
+    and unscored negatives below every scored sample."""
+    labels = numpy.ravel( labels ).astype( bool )
+    optimistic = numpy.where( scored, inner_scores, numpy.where( labels, numpy.inf, -numpy.inf ) )
+    return ( numpy.nan_to_num( roc_ci.max_tpr_at_fpr( optimistic, labels, max_fpr )[0] ) )
+
+def resubstitution_score( panel_features, labels, classifier, ranking = False ):
+    """Cheap proxy of a candidate's quality: the selection criterion of one fit
+    scored on its own training data."""
+    normalized = mt.normalize_features( panel_features )
+    model = classifier.fit( normalized, labels )
+    return ( numpy.nan_to_num( roc_ci.max_tpr_at_fpr( mt.model_scores( model, normalized, ranking ), labels, max_fpr )[0] ) )
+
+def candidate_classifier( method, scoring = "probability", random_state = None ):
+    """New classifier to fit for method, and whether it is scored by ranking.
+    Methods whose fit is randomized are given random_state."""
+    ranking = scoring == "ranking" and method in mt.ranking_classifier_factories
+    classifier = ( mt.ranking_classifier_factories if ranking else mt.classifier_factories )[ method ]()
+    if method not in mt.deterministic_methods:
+        classifier.set_params( random_state = random_state )
+    return ( classifier, ranking )
+
+def engine_loo_scores( panel_features, labels, method, scoring = "probability", warm_start_linear = False, precomputed_kernel = False ):
+    """All inner LOO scores from a fast_loo engine, or None if the candidate is
+    refit per fold. (The closed form nb engine scores many panels in one call,
+    so callers handle it.)"""
+    classifier, ranking = candidate_classifier( method, scoring )
+    if warm_start_linear and method == "lr":
+        return ( fast_loo.warm_start_lr_loo_scores( panel_features, labels, classifier.C ) )
+    if warm_start_linear and method == "lsvc" and ranking:
+        return ( fast_loo.linear_svc_loo_scores( panel_features, labels, classifier, ranking ) )
+    if precomputed_kernel and method in ( "lsvc", "rbfsvc" ):
+        return ( fast_loo.precomputed_svm_loo_scores( panel_features, labels, classifier, ranking ) )
+    return ( None )
+
+def refit_loo_scores( train_features, train_labels, test_features, panel, method, scoring = "probability", fit_cache = None, train_ids = None, test_id = None, random_state = None ):
+    """Generator of ( fold, score ) of the candidate, refitting per fold and
+    sharing fits through fit_cache if given."""
+    classifier, ranking = candidate_classifier( method, scoring, random_state )
+    if fit_cache is not None and method in mt.deterministic_methods:
+        cache_key = method + ( ":ranking" if ranking else "" )
+        return ( iter_paired_inner_loo_scores( train_features[:,panel], train_labels, classifier, test_features[:,panel], fit_cache, panel, cache_key, train_ids, test_id, ranking ) )
+    return ( iter_inner_loo_scores( train_features[:,panel], train_labels, classifier, ranking ) )
+
+def candidate_loo_scores( train_features, train_labels, test_features, panel, method, fit_cache = None, train_ids = None, test_id = None, closed_form_nb = False, warm_start_linear = False, scoring = "probability", precomputed_kernel = False, random_state = None ):
+    """Inner LOO scores of a single ( panel, method ) candidate, as
+    select_panel_method computes them with the same options and random_state
+    the candidate's seed (see candidate_seed)."""
+
+    if closed_form_nb and method == "nb":
+        return ( fast_loo.gaussian_nb_loo_scores( train_features, train_labels, [ panel ] )[:,0] )
+
+    scores = engine_loo_scores( train_features[:,panel], train_labels, method, scoring, warm_start_linear, precomputed_kernel )
+    if scores is None:
+        scores = numpy.zeros( len( train_features ) )
+        for j, score in refit_loo_scores( train_features, train_labels, test_features, panel, method, scoring, fit_cache, train_ids, test_id, random_state ):
+            scores[j] = score
+
+    return ( scores )
+
+def best_candidate( candidate_scores, labels ):
+    """Index of the candidate (column of candidate_scores) with the highest max
+    TPR at FPR <= max_fpr; the first best one wins."""
+    return ( numpy.argmax( numpy.nan_to_num( roc_ci.max_tpr_at_fpr( candidate_scores, labels, max_fpr ) ) ) )
+
+def select_panel_method( train_features, train_labels, test_features, panels, fit_cache = None, train_ids = None, test_id = None, closed_form_nb = False, warm_start_linear = False, scoring = "probability", precomputed_kernel = False, prune = False, halving = False, halving_folds = 3, halving_eta = 3, random_seed = None ):
+    """Best (panel, method) by inner LOO, with the best candidate's inner scores
+    and labels, and a dict of selection statistics to add to the result.
+    With closed_form_nb, the nb scores of all panels come from fast_loo in one call.
+    With warm_start_linear, lr uses the fast_loo warm-started lbfgs driver, which
+    only saves time on panels wider than about 5 features (at sizes 2-5 its
+    per-fold overhead matches a cold liblinear fit), and with scoring = "ranking"
+    lsvc reuses the full-data model on folds that do not hold out a support
+    vector (see fast_loo.linear_svc_loo_scores).
+    With scoring = "ranking", SVMs are fit without Platt scaling and scored by
+    their decision function, since the selection criterion only uses ranks.
+    With precomputed_kernel, SVMs share one kernel matrix across their LOO folds
+    (see fast_loo.precomputed_svm_loo_scores for how imputation differs).
+    With prune, candidates refit per fold stop as soon as they can no longer
+    beat the best so far (see pruned_selection).
+    With halving, selection is approximate: candidates are screened on a few
+    stratified folds and only the finalists get inner LOO (see halving_selection).
+    Randomized methods are seeded per candidate from random_seed (see
+    candidate_seed), so the selection does not depend on the order of the fits."""
+
+    n = len( train_features )
+
+    candidates = [ ( panel, method ) for panel in panels for method in mt.classifier_factories ]
+
+    if closed_form_nb and len( panels ) > 0:
+        nb_scores = fast_loo.gaussian_nb_loo_scores( train_features, train_labels, panels )
+
+    def engine_scores( c ):
+        # All inner LOO scores from a fast_loo engine, or None if refitting per fold
+        panel, method = candidates[c]
+        if closed_form_nb and method == "nb":
+            return ( nb_scores[:, c // len( mt.classifier_factories ) ] )
+        return ( engine_loo_scores( train_features[:,panel], train_labels, method, scoring, warm_start_linear, precomputed_kernel ) )
+
+    def fold_scores( c ):
+        # Generator of ( fold, score ), refitting per fold
+        panel, method = candidates[c]
+        return ( refit_loo_scores( train_features, train_labels, test_features, panel, method, scoring, fit_cache, train_ids, test_id, candidate_seed( random_seed, panel, method ) ) )
+
+    def proxy_score( c ):
+        panel, method = candidates[c]
+        return ( resubstitution_score( train_features[:,panel], train_labels, *candidate_classifier( method, scoring, candidate_seed( random_seed, panel, method ) ) ) )
+
+    def loo_scores( c ):
+        scores = engine_scores( c )
+        if scores is None:
+            scores = numpy.zeros( n )
+            for j, score in fold_scores( c ):
+                scores[j] = score
+        return ( scores )
+
+    def screening_scores( c, folds ):
+        panel, method = candidates[c]
+        classifier, ranking = candidate_classifier( method, scoring, candidate_seed( random_seed, panel, method ) )
+        return ( cv_scores( train_features[:,panel], train_labels, classifier, folds, ranking ) )
+
+    if halving:
+        best, best_scores, selection_info = halving_selection( len( candidates ), train_labels, loo_scores, screening_scores, halving_folds, halving_eta )
+    elif prune:
+        best, best_scores, selection_info = pruned_selection( len( candidates ), train_labels, engine_scores, fold_scores, proxy_score )
     else:
-        random_seed = numpy.random.get_state()    
+        # Inner LOO scores for every candidate, one column each
+        candidate_scores = numpy.zeros( ( n, len( candidates ) ) )
+        for c in range( len( candidates ) ):
+            candidate_scores[:,c] = loo_scores( c )
 
-    n = len( train_features )    
-    
-    best_panel = None
-    best_method = None
-    best_inner_scores = None
-    best_inner_labels = None
-    best_score = 0
-    
-    # Begin Panel+method Selection
-    for panel in get_panel_set( train_features, train_labels, panel_size ):
+        best = best_candidate( candidate_scores, train_labels )
+        best_scores = candidate_scores[:,best]
+        selection_info = dict()
 
-        panel_features = train_features[:,panel]
-    
-        for method, classifier in mt.classifier_dict.items():
-            
-            # Prepare arrays for result
-            inner_labels = numpy.zeros((n, 1))
-            inner_scores = numpy.zeros((n, 1))
-                    
-            for j, (inner_train, inner_test) in enumerate( LeaveOneOut( n ) ):
-                
-                normalized_train, normalized_test = mt.normalize_features( panel_features[inner_train], panel_features[inner_test] )
-           
-                model = classifier.fit( normalized_train, train_labels[ inner_train ] )
-                probabilities = model.predict_proba( normalized_test )
-                
-                # Record test label, test score, panel
-                inner_scores[j,0] = probabilities[0,1]
-                inner_labels[j,0] = train_labels[ inner_test ]
-            
-            # Get the ROC    
-            tp, fp, fn, tn = roc_ci.rocstats( inner_scores, inner_labels )
-            tpr = numpy.divide( tp, numpy.add( tp, fn ) )
-            fpr = numpy.divide( fp, numpy.add( fp, tn ) )
-        
-            panel_method_score = numpy.max( [tpr[i] for i in range( 0, len(tpr) ) if fpr[i] <= max_fpr] )
-
-            if panel_method_score > best_score:
-                best_panel = panel
-                best_method = method
-                best_score = panel_method_score
-                best_inner_scores = inner_scores
-                best_inner_labels = inner_labels
-    # End Panel+Method Selection
-                
-    classifier = mt.classifier_dict[ best_method ]
+    best_panel, best_method = candidates[ best ]
+    best_inner_labels = numpy.reshape( train_labels, (n, 1) ).astype( float )
+
+    return ( best_panel, best_method, numpy.reshape( best_scores, (n, 1) ), best_inner_labels, selection_info )
+
+def pruned_selection( n_candidates, labels, engine_scores, fold_scores, proxy_score ):
+    """Same selection as exhaustive search (the first candidate with the highest
+    score), evaluating candidates in decreasing order of proxy_score and
+    abandoning a candidate's folds once optimistic_score shows that it cannot
+    beat the best candidate so far. Returns the best candidate's index and inner
+    scores, and the number of fits spent, counting the proxy fits, next to the
+    number of inner fits that exhaustive selection would spend."""
+
+    n = len( labels )
+    proxies = [ proxy_score( c ) for c in range( n_candidates ) ]
+    order = sorted( range( n_candidates ), key = lambda c: -proxies[c] )
+
+    best, best_score, best_scores = None, -numpy.inf, None
+    fits, exhaustive_fits, bound_evaluations = n_candidates, 0, 0
+
+    def beats_best( score, c ):
+        return ( best is None or score > best_score or ( score == best_score and c < best ) )
+
+    for c in order:
+        scores = engine_scores( c )
+
+        if scores is None:
+            scores = numpy.zeros( n )
+            scored = numpy.zeros( n, dtype = bool )
+            folds = fold_scores( c )
+            for j, score in folds:
+                scores[j] = score
+                scored[j] = True
+                bound_evaluations += 1
+                if not beats_best( optimistic_score( scores, scored, labels ), c ):
+                    break
+            folds.close()
+            fits += int( numpy.count_nonzero( scored ) )
+            exhaustive_fits += n
+            if not scored.all():
+                continue
+
+        score = numpy.nan_to_num( roc_ci.max_tpr_at_fpr( scores, labels, max_fpr )[0] )
+        if beats_best( score, c ):
+            best, best_score, best_scores = c, score, scores
+
+    log.debug( "Pruning spent %d fits (%d of them proxies) and %d bound evaluations, saving %d of %d inner fits",
+        fits, n_candidates, bound_evaluations, exhaustive_fits - fits, exhaustive_fits )
+
+    return ( best, best_scores, { 'fits': fits, 'exhaustive_fits': exhaustive_fits } )
+
+def halving_selection( n_candidates, labels, loo_scores, screening_scores, initial_folds = 3, eta = 3 ):
+    """Approximate selection by successive halving. All candidates are scored by
+    stratified CV with initial_folds folds and the best 1/eta of them are kept;
+    survivors are re-scored with eta times as many folds, as long as that is less
+    than the smaller class size, and the finalists are compared by inner LOO.
+    Returns the best finalist's index and inner LOO scores, and the number of
+    fits spent next to the number that exhaustive selection would spend."""
+    from sklearn.cross_validation import StratifiedKFold
+
+    n = len( labels )
+    max_folds = numpy.min( numpy.unique( labels, return_counts = True )[1] )
+    alive = list( range( n_candidates ) )
+    n_folds = initial_folds
+    fits = 0
+
+    while n_folds < max_folds and len( alive ) > 1:
+        folds = list( StratifiedKFold( labels, n_folds = n_folds, shuffle = True, random_state = 0 ) )
+        scores = numpy.column_stack( [ screening_scores( c, folds ) for c in alive ] )
+        fits += n_folds * len( alive )
+
+        # Keep the best 1/eta, ties going to the earlier candidate
+        criterion = numpy.nan_to_num( roc_ci.max_tpr_at_fpr( scores, labels, max_fpr ) )
+        ranked = sorted( range( len( alive ) ), key = lambda i: -criterion[i] )
+        alive = sorted( alive[i] for i in ranked[ :int( numpy.ceil( len( alive ) / eta ) ) ] )
+        n_folds *= eta
+
+    # Finalists by inner LOO; the first best one wins
+    candidate_scores = numpy.column_stack( [ loo_scores( c ) for c in alive ] )
+    fits += n * len( alive )
+    best = best_candidate( candidate_scores, labels )
+
+    log.debug( "Halving spent %d of %d inner fits", fits, n * n_candidates )
+
+    return ( alive[ best ], candidate_scores[:, best], { 'fits': fits, 'exhaustive_fits': n * n_candidates } )
+
+def final_model_result( train_features, train_labels, test_features, test_labels, feature_labels, best_panel, best_method, best_inner_scores, best_inner_labels, random_seed, scoring = "probability" ):
+
+    classifier = candidate_classifier( best_method, random_state = task_seed( random_seed, 'final', [ int( i ) for i in best_panel ], best_method ) )[0]
     
     # Normalize the data
     normalized_train, normalized_test = mt.normalize_features( train_features[:,best_panel], test_features[:,best_panel], normal = mt.normalization_dict.get( best_method ) )
@@ -123,57 +433,331 @@ def core_pipeline( train_features, train_labels, test_features, test_labels, fea
         'label': test_labels,
         'inner_scores': best_inner_scores,
         'inner_labels': best_inner_labels,
-        'random_state': random_seed
+        'random_state': random_seed,
+        'scoring': scoring
     } )
+
+def core_pipeline_sizes( train_features, train_labels, test_features, test_labels, feature_labels, panel_sizes, random_seed = None, fit_cache = None, train_ids = None, test_id = None, C_bisection = False, **selection_options ):
+    """core_pipeline for several panel sizes sharing one panel discovery, as a
+    dict from panel size to result. C_bisection is passed to get_panel_sets and
+    the other selection_options to select_panel_method.
+    Every randomized fit is seeded from random_seed (a state as returned by
+    numpy.random.get_state, new_random_seed() by default), which is recorded as
+    the results' random_state: passing it back reproduces the results."""
+
+    if random_seed is None:
+        random_seed = new_random_seed()
+
+    panel_sets = get_panel_sets( train_features, train_labels, panel_sizes, C_bisection, task_seed( random_seed, 'panels' ) )
+
+    results = dict()
+    for panel_size in panel_sizes:
+        *selection, selection_info = select_panel_method( train_features, train_labels, test_features, panel_sets[ panel_size ], fit_cache, train_ids, test_id, random_seed = random_seed, **selection_options )
+        results[ panel_size ] = final_model_result( train_features, train_labels, test_features, test_labels, feature_labels, *selection, random_seed, selection_options.get( 'scoring', "probability" ) )
+        results[ panel_size ].update( selection_info )
+
+    return ( results )
+
+def core_key( result_cache, train_features, train_labels, test_features, test_labels, feature_labels, panel_size, random_seed, selection_options ):
+    """Key of a core_pipeline result in result_cache."""
+    return ( result_cache.key( 'core', train_features, train_labels, test_features, test_labels, feature_labels, panel_size, random_seed, selection_options, content_hash.classifier_config() ) )
+
+def core_pipeline( train_features, train_labels, test_features, test_labels, feature_labels, panel_size, random_seed = None, fit_cache = None, train_ids = None, test_id = None, result_cache = None, **selection_options ):
+    """Result of the panel size, looked up in result_cache (a ResultCache) by the
+    content of the data and configuration if given."""
+
+    if result_cache is not None:
+        key = core_key( result_cache, train_features, train_labels, test_features, test_labels, feature_labels, panel_size, random_seed, selection_options )
+        result = result_cache.get( key )
+        if result is None:
+            result = core_pipeline( train_features, train_labels, test_features, test_labels, feature_labels, panel_size, random_seed, fit_cache, train_ids, test_id, **selection_options )
+            result_cache.put( key, result, 'core p{}'.format( panel_size ) )
+        return ( result )
+
+    return ( core_pipeline_sizes( train_features, train_labels, test_features, test_labels, feature_labels, [ panel_size ], random_seed, fit_cache, train_ids, test_id, **selection_options )[ panel_size ] )
     
-    
-def outer_cv_fold( train_test, features, labels, feature_labels, panel_size ):
+def outer_cv_fold( train_test, features, labels, feature_labels, panel_sizes, fit_cache = None, **selection_options ):
     train, test = train_test
-    return ( core_pipeline( features[train], labels[train], features[test], labels[test], feature_labels, panel_size ) )
+    return ( core_pipeline_sizes( features[train], labels[train], features[test], labels[test], feature_labels, panel_sizes, fit_cache = fit_cache, train_ids = train, test_id = test[0], **selection_options ) )
     
-def run_analysis_pipeline( data, panel_size, output_file_name = None ):
+def fold_split( n, fold ):
+    """Train and test indices of outer LOO fold."""
+    return ( numpy.delete( numpy.arange( n ), fold ), numpy.array( [ fold ] ) )
+
+def shared_cv_fold( fold, panel_sizes, fit_cache = None, dataset = '', **selection_options ):
+    features, labels, feature_labels = shared_data.get( 'features', 'labels', 'feature_labels', dataset = dataset )
+    return ( fold, outer_cv_fold( fold_split( len( labels ), fold ), features, labels, feature_labels.tolist(), panel_sizes, fit_cache, **selection_options ) )
+
+def shared_core_pipeline( panel_size, training_dataset, validation_dataset, **selection_options ):
+    """core_pipeline trained on one attached data set and tested on another. The
+    worker may be on another host, so callers look the result up in their own
+    result cache (see core_key)."""
+    train_features, train_labels, feature_labels = shared_data.get( 'features', 'labels', 'feature_labels', dataset = training_dataset )
+    test_features, test_labels = shared_data.get( 'features', 'labels', dataset = validation_dataset )
+    return ( core_pipeline( numpy.array( train_features ), numpy.array( train_labels ), numpy.array( test_features ), numpy.array( test_labels ), feature_labels.tolist(), panel_size, **selection_options ) )
+
+def fold_panels_task( fold, panel_sizes, C_bisection = False, dataset = '' ):
+    features, labels = shared_data.get( 'features', 'labels', dataset = dataset )
+    train, test = fold_split( len( labels ), fold )
+    random_seed = new_random_seed()
+    return ( fold, get_panel_sets( features[train], labels[train], panel_sizes, C_bisection, task_seed( random_seed, 'panels' ) ), random_seed )
+
+def candidate_task( seeded_task, fit_cache = None, dataset = '', **selection_options ):
+    features, labels = shared_data.get( 'features', 'labels', dataset = dataset )
+    task, random_state = seeded_task
+    fold, panel, method = task
+    train, test = fold_split( len( labels ), fold )
+    options = { name: value for name, value in selection_options.items() if name in candidate_options }
+    return ( task, candidate_loo_scores( features[train], labels[train], features[test], list( panel ), method, fit_cache, train, fold, random_state = random_state, **options ) )
+
+def final_fit_task( task, scoring = "probability", dataset = '' ):
+    features, labels, feature_labels = shared_data.get( 'features', 'labels', 'feature_labels', dataset = dataset )
+    feature_labels = feature_labels.tolist()
+    fold, panel_size, panel, method, inner_scores, random_seed = task
+    train, test = fold_split( len( labels ), fold )
+    inner_labels = numpy.reshape( labels[train], ( len( train ), 1 ) ).astype( float )
+    return ( fold, panel_size, final_model_result( features[train], labels[train], features[test], labels[test], feature_labels, panel, method, numpy.reshape( inner_scores, ( len( train ), 1 ) ), inner_labels, random_seed, scoring ) )
+
+def flat_cv_folds( pool, labels, panel_sizes, folds, fit_cache = None, on_fold = None, dataset = '', **selection_options ):
+    """Outer LOO results of the given folds with exhaustive selection, as
+    outer_cv_fold computes them, run on pool as fine grained tasks: panel
+    discovery per fold, inner LOO per ( fold, panel, method ), and the final fit
+    per ( fold, panel size ) as soon as the fold's candidates are all scored.
+    Candidate tasks finish in any order; each fold's candidates are reduced in
+    the order select_panel_method uses, and every task seeds its randomized fits
+    from the fold's random_seed as core_pipeline_sizes does, so the results do
+    not depend on scheduling and replaying a fold with core_pipeline and its
+    random_state reproduces it. on_fold( fold, fold_result ) is called as each
+    fold finishes.
+    The pool's workers must have the data attached with shared_data.attach,
+    under the name dataset."""
+
+    n = len( labels )
+
+    # Panels
+    fold_panels, fold_seeds = dict(), dict()
+    for fold, panel_sets, random_seed in pool.imap_unordered( functools.partial( fold_panels_task, panel_sizes = panel_sizes, C_bisection = selection_options.get( 'C_bisection', False ), dataset = dataset ), folds ):
+        fold_panels[ fold ], fold_seeds[ fold ] = panel_sets, random_seed
+
+    candidates = { ( fold, panel_size ): [ ( tuple( panel ), method ) for panel in fold_panels[ fold ][ panel_size ] for method in mt.classifier_factories ]
+        for fold in folds for panel_size in panel_sizes }
+
+    # Inner LOO of every candidate, fold by fold and slow methods first within a fold
+    tasks = sorted( set( ( fold, panel, method ) for ( fold, panel_size ), fold_candidates in candidates.items() for panel, method in fold_candidates ),
+        key = lambda task: ( task[0], task[2] not in slow_methods, task ) )
+    remaining = { fold: 0 for fold in folds }
+    for task in tasks:
+        remaining[ task[0] ] += 1
+    log.debug( "Scheduling %d candidate tasks", len( tasks ) )
+
+    candidate_scores = dict()
+    final_fits = []
+    fold_results = dict()
+    the_final_fit = functools.partial( final_fit_task, scoring = selection_options.get( 'scoring', "probability" ), dataset = dataset )
+
+    def submit_final_fits( fold ):
+        # Reduce to the fold's selection and fit the final models
+        final_tasks = []
+        for panel_size in panel_sizes:
+            fold_candidates = candidates[ ( fold, panel_size ) ]
+            scores = numpy.column_stack( [ candidate_scores[ ( fold, panel, method ) ] for panel, method in fold_candidates ] )
+            best = best_candidate( scores, labels[ fold_split( n, fold )[0] ] )
+            panel, method = fold_candidates[ best ]
+            final_tasks.append( ( fold, panel_size, list( panel ), method, scores[:, best], fold_seeds[ fold ] ) )
+        final_fits.append( ( fold, pool.map_async( the_final_fit, final_tasks ) ) )
+
+    def collect_final_fits( wait ):
+        for fold, final_fit in list( final_fits ):
+            if wait or final_fit.ready():
+                fold_results[ fold ] = { panel_size: result for _, panel_size, result in final_fit.get() }
+                final_fits.remove( ( fold, final_fit ) )
+                if on_fold is not None:
+                    on_fold( fold, fold_results[ fold ] )
+
+    seeded_tasks = [ ( task, candidate_seed( fold_seeds[ task[0] ], task[1], task[2] ) ) for task in tasks ]
+    for task, scores in pool.imap_unordered( functools.partial( candidate_task, fit_cache = fit_cache, dataset = dataset, **selection_options ), seeded_tasks ):
+        candidate_scores[ task ] = scores
+        remaining[ task[0] ] -= 1
+        if remaining[ task[0] ] == 0:
+            submit_final_fits( task[0] )
+        collect_final_fits( wait = False )
+
+    for fold in folds:
+        if fold not in fold_results and not any( fold == submitted for submitted, _ in final_fits ):
+            submit_final_fits( fold )
+    collect_final_fits( wait = True )
+
+    return ( fold_results )
+
+def run_key( features, labels, feature_labels, panel_sizes, selection_options ):
+    """Hash of everything that determines a run's results, including the code
+    and library versions."""
+    return ( content_hash.digest( features, labels, feature_labels, sorted( panel_sizes ), selection_options, content_hash.classifier_config(), content_hash.code_version() ) )
+
+def run_analysis_pipeline_sizes( data, panel_sizes, output_file_names = None, pair_cache = False, processes = None, backend = "process", store_directory = None, result_cache = None, pool = None, dataset = '', coordinator = None, **selection_options ):
+    """Outer LOO over the data evaluating all panel_sizes in each fold. Returns a
+    dict from panel size to list of fold results; output_file_names, if given,
+    maps panel sizes to output file names (columnar if they end in .cols, see
+    result_format, and pickles otherwise).
+    With pair_cache, fits of deterministic methods are shared between outer
+    folds i and j that train on the same samples. selection_options are passed
+    to select_panel_method, except C_bisection, which is passed to
+    get_panel_sets.
+    Runs on processes workers (all cores by default), which are processes, or
+    with backend = "thread" threads of this process: the sklearn fits release
+    the GIL, and threads share the interpreter and data. With backend =
+    "distributed", tasks are handed out over TCP to workers on any host by a
+    distributed.Coordinator made with the dict of options coordinator (address,
+    authkey, lease_timeout, max_attempts). Exhaustive selection
+    is scheduled per candidate (see flat_cv_folds); prune and halving decide
+    what to fit next from earlier fits, so they run a task per fold.
+    The data is published to the workers once as memory-mapped files (see
+    shared_data), so tasks only carry fold and feature indices.
+    With store_directory, every finished fold is appended to a FoldStore keyed
+    by run_key, folds already in it are not recomputed, and the results are
+    assembled from it; the store is removed once the outputs are written.
+    With result_cache (a ResultCache), the results of each panel size are
+    looked up by the content of the data and configuration, and only the
+    panel sizes that miss are run.
+    With pool, the folds run on that pool instead of a new one; its workers
+    must have the data attached with shared_data.attach, under the name dataset."""
     
-    log.debug( "Panel size %d", panel_size )
+    log.debug( "Panel sizes %s", panel_sizes )
     
-    n = data.shape[0]
     n_features = data.shape[1]-1
     feature_labels = list(data)[0:n_features]
     features = numpy.array( data.ix[:,:n_features] )
     labels = numpy.array( data.ix[:,n_features] )
 
-    the_cv_fold = functools.partial( outer_cv_fold, features = features, labels = labels, feature_labels = feature_labels, panel_size = panel_size )
-    
-    with Pool(10) as p:
-        results = p.map( the_cv_fold, LeaveOneOut(n) )
-
-    if output_file_name is not None:
-        with open( output_file_name, 'wb') as outfile:
-            dump( list( results ), outfile )
-            
-        log.debug( "Panel size %d results saved", panel_size )
+    results = dict()
+    if result_cache is not None:
+        keys = { panel_size: result_cache.key( 'cv', features, labels, feature_labels, panel_size, selection_options, content_hash.classifier_config() ) for panel_size in panel_sizes }
+        for panel_size in panel_sizes:
+            result = result_cache.get( keys[ panel_size ] )
+            if result is not None:
+                results[ panel_size ] = result
+
+    missing_sizes = [ panel_size for panel_size in panel_sizes if panel_size not in results ]
+    if missing_sizes:
+        results.update( cv_results( features, labels, feature_labels, missing_sizes, pair_cache, processes, backend, store_directory, pool, dataset, coordinator, **selection_options ) )
+        if result_cache is not None:
+            for panel_size in missing_sizes:
+                description = 'cv p{}'.format( panel_size ) if output_file_names is None else output_file_names[ panel_size ]
+                result_cache.put( keys[ panel_size ], results[ panel_size ], description )
+
+    if output_file_names is not None:
+        for panel_size in panel_sizes:
+            result_format.save( output_file_names[ panel_size ], results[ panel_size ] )
+            log.debug( "Panel size %d results saved", panel_size )
+
+    # The finished run's folds are no longer needed for resuming it
+    if missing_sizes and store_directory is not None:
+        FoldStore( store_directory, run_key( features, labels, feature_labels, missing_sizes, selection_options ) ).remove()
     
     return ( results )
 
+def pool_cv_folds( pool, labels, panel_sizes, folds, fit_cache = None, on_fold = None, dataset = '', **selection_options ):
+    """Results of the given outer LOO folds run on pool, as a dict from fold to
+    fold result. The pool's workers must have the data attached with
+    shared_data.attach, under the name dataset."""
+
+    if selection_options.get( 'prune' ) or selection_options.get( 'halving' ):
+        fold_results = dict()
+        the_cv_fold = functools.partial( shared_cv_fold, panel_sizes = panel_sizes, fit_cache = fit_cache, dataset = dataset, **selection_options )
+        for fold, fold_result in pool.imap_unordered( the_cv_fold, folds ):
+            fold_results[ fold ] = fold_result
+            if on_fold is not None:
+                on_fold( fold, fold_result )
+        return ( fold_results )
+
+    return ( flat_cv_folds( pool, labels, panel_sizes, folds, fit_cache, on_fold, dataset, **selection_options ) )
+
+def new_pool( processes = None, backend = "process", shared = None, coordinator = None ):
+    """Pool of processes workers (all cores by default), which are processes or
+    with backend = "thread" threads, with the shared_data paths shared attached.
+    With backend = "distributed", a distributed.Coordinator made with the dict
+    of options coordinator, whose workers connect to it separately."""
+    if backend == "distributed":
+        return ( distributed.Coordinator( shared = shared, **coordinator ) )
+    if processes is None:
+        processes = os.cpu_count()
+    pool_class = ThreadPool if backend == "thread" else Pool
+    return ( pool_class( processes, initializer = shared_data.attach, initargs = ( shared or dict(), ) ) )
+
+def cv_results( features, labels, feature_labels, panel_sizes, pair_cache = False, processes = None, backend = "process", store_directory = None, pool = None, dataset = '', coordinator = None, **selection_options ):
+    """The outer LOO of run_analysis_pipeline_sizes, as a dict from panel size
+    to list of fold results. Runs on pool if given, whose workers must have the
+    data attached under the name dataset, and otherwise on a new pool."""
+
+    n = len( labels )
+
+    if pair_cache and ( backend == "distributed" or isinstance( pool, distributed.Coordinator ) ):
+        log.warning( "The pair cache is local to this host, running without it" )
+        pair_cache = False
+
+    if store_directory is not None:
+        store = FoldStore( store_directory, run_key( features, labels, feature_labels, panel_sizes, selection_options ) )
+        fold_results = store.load()
+        on_fold = store.append
+    else:
+        fold_results = dict()
+        on_fold = None
+
+    folds = [ fold for fold in range( n ) if fold not in fold_results ]
+    log.debug( "%d of %d folds to run", len( folds ), n )
+
+    if folds:
+        with tempfile.TemporaryDirectory() as cache_directory:
+
+            fit_cache = PairFitCache( cache_directory, n ) if pair_cache else None
+
+            if pool is not None:
+                fold_results.update( pool_cv_folds( pool, labels, panel_sizes, folds, fit_cache, on_fold, dataset, **selection_options ) )
+            else:
+                shared = shared_data.publish( cache_directory, features = features, labels = labels, feature_labels = feature_labels )
+                with new_pool( processes, backend, shared, coordinator ) as p:
+                    fold_results.update( pool_cv_folds( p, labels, panel_sizes, folds, fit_cache, on_fold, **selection_options ) )
+
+    if store_directory is not None:
+        fold_results = store.load()
+
+    return ( { panel_size: [ fold_results[ fold ][ panel_size ] for fold in range( n ) ] for panel_size in panel_sizes } )
+
+def run_analysis_pipeline( data, panel_size, output_file_name = None, pair_cache = False, processes = None, backend = "process", store_directory = None, result_cache = None, coordinator = None, **selection_options ):
+    return ( run_analysis_pipeline_sizes(
+        data,
+        [ panel_size ],
+        None if output_file_name is None else { panel_size: output_file_name },
+        pair_cache,
+        processes,
+        backend,
+        store_directory,
+        result_cache,
+        coordinator = coordinator,
+        **selection_options )[ panel_size ] )
+
 # Main run
 if __name__ == '__main__':
 
     log.warning( 'Running analysis_pipeline.py directly is deprecated, it is recommended to run run_cv_analysis.py with command line arguments.')
 
+    from pandas import read_csv
+
     log.debug( 'Running' )    
     
     for question in [1,2,3]:
         
         log.debug( "Question %d", question )
         
-        data = pandas.read_csv('../clean-data/q'+str(question)+'-training.csv')
-
-        for panel_size in [2,3,4,5]:
-            result = run_analysis_pipeline(
-                data = data,
-                panel_size = panel_size,
-                output_file_name = 'results/roc_results_q'+str(question)+'_p'+str(panel_size)+'.pkl'
-            )        
-            log.info( str( result ) )
+        data = read_csv('../clean-data/q'+str(question)+'-training.csv')
+
+        panel_sizes = [2,3,4,5]
+        result = run_analysis_pipeline_sizes(
+            data = data,
+            panel_sizes = panel_sizes,
+            output_file_names = { panel_size: 'results/roc_results_q'+str(question)+'_p'+str(panel_size)+'.pkl' for panel_size in panel_sizes }
+        )        
+        log.info( str( result ) )
     # Get the ROC    
 #    tp, fp, fn, tn = roc_ci.rocstats( roc_scores, roc_labels )
 #    tpr = numpy.divide( tp, numpy.add( tp, fn ) )
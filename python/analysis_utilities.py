@@ -4,15 +4,15 @@
 #
 
 import numpy
-import matplotlib.pyplot as plt
 import roc_ci
-from sklearn.metrics import roc_curve, auc
-from sklearn.cross_validation import LeaveOneOut
-from sklearn import preprocessing
-from matplotlib.backends.backend_pdf import PdfPages
+
+# matplotlib and sklearn are imported by the functions that use them, so that
+# scripts importing these utilities start quickly
 
 #Generate an ROC Curve 
 def plotROC( fpr, tpr, roc_auc, plot_title, plot = True, pdf_file = None, plotover = None, plotunder = None ):
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
     fig = plt.figure(figsize=(8, 8))
     if plotunder is not None:
         plotunder()
@@ -38,13 +38,17 @@ def plotROC( fpr, tpr, roc_auc, plot_title, plot = True, pdf_file = None, plotov
             pdf.savefig( fig )
     plt.close()
     
-def plotROCwithCRfromScores( scores, labels, plot_title = None, plot = True, pdf_file = None, plotover = None ):
-    """Plot ROC with confidence regions on points, from the classifier scores and true labels."""
+def plotROCwithCRfromScores( scores, labels, plot_title = None, plot = True, pdf_file = None, plotover = None, resolution = 300, surface_dtype = numpy.float64, adaptive = False ):
+    """Plot ROC with confidence regions on points, from the classifier scores and true labels.
+    Confidence surfaces are generated and reduced to hulls one at a time while plotting.
+    With adaptive, only the part of each surface where the mass lives is computed, which
+    allows resolutions in the thousands."""
+    from sklearn.metrics import auc
     tp, fp, fn, tn = roc_ci.rocstats( scores, labels )
     tpr = numpy.divide( tp, numpy.add( tp, fn ) )
     fpr = numpy.divide( fp, numpy.add( fp, tn ) )
     auroc = auc( fpr, tpr )
-    confidence_surfaces = roc_ci.roc_surfaces( tp, fp, fn, tn, n=300 )
+    confidence_surfaces = roc_ci.iter_roc_surfaces( tp, fp, fn, tn, n = resolution, dtype = surface_dtype, adaptive = adaptive )
     
     plotROC(
         fpr,
@@ -57,6 +61,8 @@ def plotROCwithCRfromScores( scores, labels, plot_title = None, plot = True, pdf
         plotunder = lambda : roc_ci.plot_hulls( confidence_surfaces, invert_x = True ) )    
     
 def plotROCPDF(fpr, tpr,roc_auc, classifier_name,plot):
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
     with PdfPages('/Users/serge/Downloads/Summer/Presentation/q1_svm_cv.pdf') as pdf:
         fig= plt.figure(figsize=(8, 8))
         plt.grid()
@@ -79,6 +85,7 @@ def plotROCPDF(fpr, tpr,roc_auc, classifier_name,plot):
 
 #Preform loo CV for all classfiers but SVMs
 def generateROC(cv, classifier, features, labels, classifier_name, normal = None, plot = True, pdf_file = None, plotover = None ):
+    from sklearn import preprocessing
     pool=numpy.zeros((len(labels), 2))
     normal_features=features
     if(normal=="log"):
@@ -95,6 +102,8 @@ def generateROC(cv, classifier, features, labels, classifier_name, normal = None
     
 #Preform loo CV for all classfiers but SVMs
 def generateROCcoef(cv, classifier, features, labels, classifier_name, normal=None,plot=True):
+    from sklearn.metrics import roc_curve, auc
+    from sklearn import preprocessing
     pool=numpy.zeros((len(labels), 2))
     coefs=numpy.zeros((numpy.shape(features)[1], len(labels)))
     normal_features=features
@@ -118,6 +127,7 @@ def generateROCcoef(cv, classifier, features, labels, classifier_name, normal=No
 
 #Preform loo CV for SVMs
 def generateROCdf( cv, classifier, features, feature_names, labels, classifier_name, normal = None, plot = True, pdf_file = None, plotover = None):
+    from sklearn import preprocessing
     pool=numpy.zeros((len(labels), 2))
     normal_features=features
     if(normal=="log"):
@@ -134,6 +144,8 @@ def generateROCdf( cv, classifier, features, feature_names, labels, classifier_n
 
 #Preform loo CV for SVMs
 def generateROCdfcoef(cv, classifier, features, feature_names, labels, classifier_name, normal=None,plot=True):
+    from sklearn.metrics import roc_curve, auc
+    from sklearn import preprocessing
     pool=numpy.zeros((len(labels), 2))
     coefs=numpy.zeros((len(feature_names), len(labels)))
     normal_features=features
@@ -157,6 +169,8 @@ def generateROCdfcoef(cv, classifier, features, feature_names, labels, classifie
 
 #Preform loo CV and get feature importance for random forests and extra trees
 def generateROCTrees(cv, classifier, features, labels, classifier_name, normal=None,plot=True):
+    from sklearn.metrics import roc_curve, auc
+    from sklearn import preprocessing
     feature_importance=numpy.zeros((numpy.shape(features)[1],len(labels)))
     pool=numpy.zeros((len(labels), 2))
     normal_features=features
@@ -180,6 +194,9 @@ def generateROCTrees(cv, classifier, features, labels, classifier_name, normal=N
 
 #Nested CV for Logistic Regression w/ l1 penalty
 def nestedCVLR(features, labels, classifier_name, normal=None,plot=True):
+    from sklearn.metrics import roc_curve, auc
+    from sklearn.cross_validation import LeaveOneOut
+    from sklearn import preprocessing
     looOuter= LeaveOneOut(len(labels))
     poolOuter=numpy.zeros((len(labels), 2))
     Cs=numpy.zeros((len(labels)))
@@ -230,6 +247,9 @@ def nestedCVLR(features, labels, classifier_name, normal=None,plot=True):
     
 #Nested CV for SVM
 def nestedCVSVM(features, labels, classifier_name, normal=None,plot=True, rbf=False):
+    from sklearn.metrics import roc_curve, auc
+    from sklearn.cross_validation import LeaveOneOut
+    from sklearn import preprocessing
     looOuter= LeaveOneOut(len(labels))
     poolOuter=numpy.zeros((len(labels), 2))
     Cs=numpy.zeros((len(labels)))
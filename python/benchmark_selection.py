@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark approximate (successive halving) selection against exhaustive selection
+
+Usage: benchmark_selection.py training.csv panel_size [n_folds [halving_folds halving_eta]]
+
+Runs select_panel_method both ways on the training sets of the first n_folds
+outer LOO folds (all of them by default) and reports how often the two select
+the same panel and method, how often halving's choice scores as well on the
+exhaustive criterion, and the inner fits each spends.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import time
+import numpy
+import logging
+import roc_ci
+import analysis_pipeline
+from sys import argv
+from pandas import read_csv
+from misc_tools import unpack
+from sklearn.cross_validation import LeaveOneOut
+
+# Global constants
+logging.basicConfig( level = logging.INFO )
+log = logging.getLogger(__name__)
+log.setLevel( logging.INFO )
+
+def compare_fold( train_features, train_labels, test_features, panel_size, halving_folds, halving_eta ):
+
+    panels = analysis_pipeline.get_panel_set( train_features, train_labels, panel_size )
+    n_fits = len( train_features ) * len( panels ) * len( analysis_pipeline.mt.classifier_factories )
+
+    # Same random seed for both, so that the randomized methods fit the same way
+    random_seed = analysis_pipeline.new_random_seed()
+
+    start = time.time()
+    exhaustive = analysis_pipeline.select_panel_method( train_features, train_labels, test_features, panels, random_seed = random_seed )
+    exhaustive_time = time.time() - start
+
+    start = time.time()
+    halving = analysis_pipeline.select_panel_method( train_features, train_labels, test_features, panels,
+        halving = True, halving_folds = halving_folds, halving_eta = halving_eta, random_seed = random_seed )
+    halving_time = time.time() - start
+
+    exhaustive_score, halving_score = ( roc_ci.max_tpr_at_fpr( selection[2], train_labels, analysis_pipeline.max_fpr )[0] for selection in ( exhaustive, halving ) )
+
+    return ( {
+        'same': exhaustive[:2] == halving[:2],
+        'regret': numpy.nan_to_num( exhaustive_score ) - numpy.nan_to_num( halving_score ),
+        'exhaustive_fits': n_fits,
+        'halving_fits': halving[4]['fits'],
+        'exhaustive_time': exhaustive_time,
+        'halving_time': halving_time } )
+
+# Main run
+if __name__ == '__main__':
+
+    training_filename = argv[1]
+    panel_size = int( argv[2] )
+    halving_folds = int( argv[4] ) if len( argv ) > 4 else 3
+    halving_eta = int( argv[5] ) if len( argv ) > 5 else 3
+
+    features, labels, feature_labels = unpack( read_csv( training_filename ) )
+    n = len( labels )
+    n_folds = int( argv[3] ) if len( argv ) > 3 else n
+
+    comparisons = []
+    for train, test in list( LeaveOneOut( n ) )[:n_folds]:
+        comparisons.append( compare_fold( features[train], labels[train], features[test], panel_size, halving_folds, halving_eta ) )
+        log.info( 'Fold %d: %s', test[0], comparisons[-1] )
+
+    def total( key ):
+        return ( sum( c[key] for c in comparisons ) )
+
+    log.info( 'Same selection in %d of %d folds', total( 'same' ), len( comparisons ) )
+    log.info( 'Halving choice scored lower on the exhaustive criterion in %d folds, mean regret %.4f',
+        sum( c['regret'] > 0 for c in comparisons ), total( 'regret' ) / len( comparisons ) )
+    log.info( 'Inner fits: exhaustive %d, halving %d (%.1f%%)',
+        total( 'exhaustive_fits' ), total( 'halving_fits' ), 100. * total( 'halving_fits' ) / total( 'exhaustive_fits' ) )
+    log.info( 'Selection time: exhaustive %.1fs, halving %.1fs', total( 'exhaustive_time' ), total( 'halving_time' ) )
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Import-time budget of the command line scripts
+
+Usage: check_import_time.py [--scale X] [--repeat N]
+
+Imports each entry point in a fresh interpreter with python -X importtime and
+fails if its cumulative import time (best of N runs) is over its budget, or if
+it imports any of heavy_modules at import time: the scripts only import
+matplotlib, scipy, scikit-image, sklearn and pandas in the functions that use
+them, so that --help, cache hits and plotting start without paying for the
+rest. Budgets are multiples of the time of importing numpy alone, measured in
+the same way alternately with each entry point, so that they hold on slower
+machines and under load: numpy is most of every entry point's import time, and
+the budgets are about 1.6 times the measured ratios. --scale stretches them.
+test_import_time runs the same check under pytest.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import os
+import sys
+import subprocess
+from argparse import ArgumentParser
+
+# Budgets of cumulative import time, as multiples of numpy's
+budgets = {
+    'plot_cv_roc': 2.0,
+    'plot_val_roc': 2.0,
+    'run_cv_analysis': 2.5,
+    'run_val_analysis': 2.5,
+    'run_batch': 2.5,
+    'result_cache': 2.0,
+    'result_format': 2.0,
+    'distributed': 2.0
+}
+
+# Packages none of the entry points may import at import time
+heavy_modules = ( 'matplotlib', 'scipy', 'skimage', 'sklearn', 'pandas' )
+
+def import_times( module ):
+    """Dict of package to cumulative import time (ms) of importing module in a
+    fresh interpreter."""
+    process = subprocess.run(
+        [ sys.executable, '-X', 'importtime', '-c', 'import ' + module ],
+        cwd = os.path.dirname( os.path.abspath( __file__ ) ),
+        stderr = subprocess.PIPE,
+        universal_newlines = True,
+        check = True )
+    times = dict()
+    for line in process.stderr.splitlines():
+        if not line.startswith( 'import time:' ) or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, package = line[ len( 'import time:' ): ].split( '|' )
+        times[ package.strip() ] = int( cumulative_us ) / 1000
+    return ( times )
+
+def check( module, repeat = 3 ):
+    """( best time, best time of numpy, heavy packages imported ), the times
+    being the smallest of repeat runs, alternating between module and numpy."""
+    runs, numpy_runs = [], []
+    for i in range( repeat ):
+        runs.append( import_times( module ) )
+        numpy_runs.append( import_times( 'numpy' ) )
+    heavy = sorted( set( package.split( '.' )[0] for package in runs[0] ) & set( heavy_modules ) )
+    return ( min( times[ module ] for times in runs ), min( times[ 'numpy' ] for times in numpy_runs ), heavy )
+
+# Main run
+if __name__ == '__main__':
+
+    parser = ArgumentParser( description = 'Check the import time of the command line scripts' )
+    parser.add_argument( '--scale', type = float, default = 1.0, help = 'multiply the budgets by this' )
+    parser.add_argument( '--repeat', type = int, default = 3, help = 'runs per script, the best of which is compared' )
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget in budgets.items():
+        time_ms, numpy_ms, heavy = check( module, args.repeat )
+        over = time_ms > budget * args.scale * numpy_ms
+        print( '{:20s} {:7.1f} ms of {:7.1f} ms ({:.2f} of {:.2f} x numpy){}{}'.format(
+            module, time_ms, budget * args.scale * numpy_ms, time_ms / numpy_ms, budget * args.scale,
+            '  OVER BUDGET' if over else '',
+            '  imports ' + ', '.join( heavy ) if heavy else '' ) )
+        failed = failed or over or bool( heavy )
+
+    sys.exit( 1 if failed else 0 )
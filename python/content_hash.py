@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Hashes of analysis inputs and configuration, for keying stored results
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import os
+import numpy
+import hashlib
+import misc_tools as mt
+
+# Modules whose code determines analysis results
+result_modules = [ 'analysis_pipeline', 'misc_tools', 'fast_loo', 'roc_ci', 'pair_cache' ]
+
+def update( h, obj ):
+    """Feed obj into hash h; arrays by dtype, shape and contents, containers
+    element-wise (dicts in key order), anything else by repr."""
+    if isinstance( obj, numpy.ndarray ):
+        h.update( repr( ( 'array', obj.dtype.str, obj.shape ) ).encode() )
+        h.update( numpy.ascontiguousarray( obj ).tobytes() )
+    elif isinstance( obj, dict ):
+        h.update( b'dict' )
+        for key in sorted( obj, key = repr ):
+            update( h, key )
+            update( h, obj[ key ] )
+    elif isinstance( obj, ( list, tuple ) ):
+        h.update( repr( ( type( obj ).__name__, len( obj ) ) ).encode() )
+        for item in obj:
+            update( h, item )
+    else:
+        h.update( repr( obj ).encode() )
+
+def digest( *objects ):
+    h = hashlib.sha1()
+    for obj in objects:
+        update( h, obj )
+    return ( h.hexdigest() )
+
+def classifier_config():
+    """Everything in misc_tools that determines which models are fit."""
+    return ( {
+        'classifiers': { method: repr( factory() ) for method, factory in mt.classifier_factories.items() },
+        'ranking_classifiers': { method: repr( factory() ) for method, factory in mt.ranking_classifier_factories.items() },
+        'normalization': mt.normalization_dict,
+        'feature_selection_C': [ repr( method( 1.0 ) ) for method in mt.feature_selection_C_methods ],
+        'feature_selection_tree': [ repr( method() ) for method in mt.feature_selection_tree_methods ] } )
+
+def code_version():
+    """Hash of the source of result_modules and the numpy and sklearn versions."""
+    import sklearn
+    h = hashlib.sha1()
+    update( h, ( numpy.__version__, sklearn.__version__ ) )
+    directory = os.path.dirname( os.path.abspath( __file__ ) )
+    for module in result_modules:
+        with open( os.path.join( directory, module + '.py' ), 'rb' ) as infile:
+            h.update( infile.read() )
+    return ( h.hexdigest() )
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Distributed execution of pipeline tasks over TCP
+
+A Coordinator stands in for the multiprocessing pool of run_analysis_pipeline:
+it queues the same tasks (a picklable function and its arguments) and hands
+them out to workers that connect to it, possibly from other hosts, with
+multiprocessing.connection. Each worker first receives the published data sets
+(see shared_data) and then runs one task at a time.
+
+A task whose worker disconnects is put back in the queue, up to max_attempts
+times: a task that keeps taking its worker down (say by running out of memory)
+then fails instead of taking down every worker in turn. A task that has been
+out for longer than lease_timeout is handed out again to an idle worker. Only
+the first result of a task is kept, so a task that runs twice is recorded once.
+
+Usage: distributed.py host:port [--processes N] [--authkey KEY]
+
+starts N workers (one by default) of the coordinator at host:port. The authkey
+defaults to the PANEL_AUTHKEY environment variable and must not be empty: the
+coordinator and workers exchange pickles, so anyone who can connect without it
+could run code on either side. To try it on one machine, run the pipeline with
+backend = "distributed" and coordinator = { 'address': ( 'localhost', port ),
+'authkey': key, 'lease_timeout': None }, and start workers on localhost:port.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import os
+import time
+import numpy
+import logging
+import threading
+import collections
+import shared_data
+from argparse import ArgumentParser
+from multiprocessing import Process
+from multiprocessing.connection import Listener, Client
+from concurrent.futures import Future, as_completed
+
+log = logging.getLogger(__name__)
+
+class MapResult:
+    """What Pool.map_async returns, over a list of futures."""
+
+    def __init__( self, futures ):
+        self.futures = futures
+
+    def ready( self ):
+        return ( all( future.done() for future in self.futures ) )
+
+    def get( self ):
+        return ( [ future.result() for future in self.futures ] )
+
+def check_authkey( authkey ):
+    if not authkey:
+        raise ValueError( 'An authkey is required: tasks and results are pickles, which run code when loaded' )
+
+class Coordinator:
+
+    def __init__( self, address, authkey, shared = None, lease_timeout = None, max_attempts = 3 ):
+        check_authkey( authkey )
+        self.listener = Listener( address, authkey = authkey )
+        self.arrays = { key: numpy.load( path ) for key, path in ( shared or dict() ).items() }
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.condition = threading.Condition()
+        self.tasks = dict()
+        self.futures = dict()
+        self.pending = collections.deque()
+        self.leased = dict() # task id to time handed out
+        self.lost = collections.Counter() # task id to number of workers lost running it
+        self.closed = False
+        threading.Thread( target = self.accept, daemon = True ).start()
+        log.info( "Coordinator listening on %s", self.listener.address )
+
+    # Pool interface
+
+    def apply_async( self, func, args = (), kwds = dict() ):
+        with self.condition:
+            task_id = len( self.tasks )
+            self.tasks[ task_id ] = ( func, args, kwds )
+            self.futures[ task_id ] = Future()
+            self.pending.append( task_id )
+            self.condition.notify_all()
+        return ( self.futures[ task_id ] )
+
+    def apply( self, func, args = (), kwds = dict() ):
+        return ( self.apply_async( func, args, kwds ).result() )
+
+    def map_async( self, func, iterable, chunksize = None ):
+        return ( MapResult( [ self.apply_async( func, ( item, ) ) for item in iterable ] ) )
+
+    def map( self, func, iterable, chunksize = None ):
+        return ( self.map_async( func, iterable ).get() )
+
+    def imap_unordered( self, func, iterable, chunksize = 1 ):
+        for future in as_completed( [ self.apply_async( func, ( item, ) ) for item in iterable ] ):
+            yield ( future.result() )
+
+    def close( self ):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.listener.close()
+
+    def __enter__( self ):
+        return ( self )
+
+    def __exit__( self, *exception ):
+        self.close()
+
+    # Serving workers
+
+    def accept( self ):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except OSError:
+                return # Listener closed
+            threading.Thread( target = self.serve, args = ( connection, ), daemon = True ).start()
+
+    def next_task( self ):
+        """Next task id to hand out, or None once closed. Waits while there is
+        nothing to hand out."""
+        with self.condition:
+            while not self.closed:
+                if self.pending:
+                    task_id = self.pending.popleft()
+                    if not self.futures[ task_id ].done():
+                        self.leased[ task_id ] = time.time()
+                        return ( task_id )
+                    continue
+                if self.lease_timeout is not None:
+                    overdue = [ task_id for task_id, start in self.leased.items() if time.time() - start > self.lease_timeout ]
+                    if overdue:
+                        log.warning( "Task %d is overdue, handing it out again", overdue[0] )
+                        self.leased[ overdue[0] ] = time.time()
+                        return ( overdue[0] )
+                self.condition.wait( timeout = self.lease_timeout )
+            return ( None )
+
+    def finish( self, task_id, status, value ):
+        with self.condition:
+            self.leased.pop( task_id, None )
+            future = self.futures[ task_id ]
+            if future.done():
+                return # Result of a task that was handed out twice
+            if status == 'ok':
+                future.set_result( value )
+            else:
+                future.set_exception( value )
+
+    def requeue( self, task_id ):
+        """Put back the task of a lost worker, or fail it once it has lost
+        max_attempts workers."""
+        with self.condition:
+            self.leased.pop( task_id, None )
+            self.lost[ task_id ] += 1
+            future = self.futures[ task_id ]
+            if future.done():
+                return
+            if self.lost[ task_id ] >= self.max_attempts:
+                log.error( "Task %d lost its worker %d times, giving up on it", task_id, self.lost[ task_id ] )
+                future.set_exception( RuntimeError( 'Task {} lost its worker {} times'.format( task_id, self.lost[ task_id ] ) ) )
+            else:
+                log.warning( "Lost the worker of task %d, requeueing it", task_id )
+                self.pending.appendleft( task_id )
+                self.condition.notify_all()
+
+    def serve( self, connection ):
+        task_id = None
+        try:
+            connection.send( ( 'attach', self.arrays ) )
+            while True:
+                task_id = self.next_task()
+                if task_id is None:
+                    connection.send( ( 'close', ) )
+                    return
+                connection.send( ( 'task', task_id, self.tasks[ task_id ] ) )
+                status, value = connection.recv()
+                self.finish( task_id, status, value )
+                task_id = None
+        except ( EOFError, OSError ):
+            if task_id is not None:
+                self.requeue( task_id )
+        finally:
+            connection.close()
+
+def run_worker( address, authkey, connect_timeout = 60 ):
+    """Run tasks of the coordinator at address until it closes."""
+
+    check_authkey( authkey )
+    start = time.time()
+    while True:
+        try:
+            connection = Client( address, authkey = authkey )
+            break
+        except ConnectionRefusedError:
+            if time.time() - start > connect_timeout:
+                raise
+            time.sleep( 1 )
+
+    with connection:
+        while True:
+            try:
+                message = connection.recv()
+            except EOFError:
+                return
+            if message[0] == 'attach':
+                shared_data.attached.update( message[1] )
+            elif message[0] == 'task':
+                func, args, kwds = message[2]
+                try:
+                    result = ( 'ok', func( *args, **kwds ) )
+                except Exception as exception:
+                    log.exception( "Task %d failed", message[1] )
+                    result = ( 'error', exception )
+                connection.send( result )
+            else:
+                return
+
+def parse_address( address ):
+    host, port = address.rsplit( ':', 1 )
+    return ( ( host, int( port ) ) )
+
+# Main run
+if __name__ == '__main__':
+
+    logging.basicConfig( level = logging.INFO )
+
+    parser = ArgumentParser( description = 'Run pipeline workers for a coordinator' )
+    parser.add_argument( 'address', help = 'host:port of the coordinator' )
+    parser.add_argument( '--processes', type = int, default = 1 )
+    parser.add_argument( '--authkey', default = os.environ.get( 'PANEL_AUTHKEY', '' ) )
+    args = parser.parse_args()
+
+    if not args.authkey:
+        parser.error( 'an authkey is required, give --authkey or set PANEL_AUTHKEY' )
+
+    workers = [ Process( target = run_worker, args = ( parse_address( args.address ), args.authkey.encode() ) ) for i in range( args.processes ) ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
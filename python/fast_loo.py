@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Leave-one-out engines that avoid refitting a model for every fold
+
+Each engine computes the inner LOO scores of refitting mt.normalize_features
+(mean imputation) and the classifier on every fold. The nb engine and the lsvc
+engine without ranking return the same scores; the lr and ranking lsvc engines
+agree to within solver tolerance; the precomputed kernel engine imputes with
+the means of all rows, so it only agrees on panels without missing values.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import numpy
+import misc_tools as mt
+
+def gaussian_nb_loo_scores( features, labels, panels, var_smoothing = 1e-9 ):
+    """LOO class 1 probabilities of mean imputation followed by GaussianNB, for
+    each of a list of equal-size panels, as an (n x len(panels)) matrix.
+
+    Class counts, sums and sums of squares are computed once on all n rows and
+    the held out row is subtracted to get each fold's model, so the cost is
+    O(n p) instead of O(n^2 p) per panel. A fold that holds out the only
+    observed value of a panel column is refit, since its imputer drops the
+    column. Every class needs two samples, or the fold holding out the only
+    sample of a class has no model to score."""
+
+    features = numpy.asarray( features, dtype = float )
+    labels = numpy.ravel( labels )
+    panels = numpy.asarray( panels, dtype = int ).reshape( len( panels ), -1 )
+    n = len( features )
+
+    classes, class_counts = numpy.unique( labels, return_counts = True )
+    if len( classes ) < 2 or class_counts.min() < 2:
+        raise ValueError( 'LOO with GaussianNB needs two samples of each of two classes, got class counts ' + str( dict( zip( classes, class_counts ) ) ) )
+
+    # Centering does not change the model and reduces cancellation in the variances
+    observed = ~numpy.isnan( features )
+    x = features - numpy.nanmean( features, axis = 0 )
+    x[ ~observed ] = 0
+
+    # Column means of each fold's training rows, used for imputation (0 where
+    # the fold has no observed value: those folds are refit below)
+    fold_observed = observed.sum( axis = 0 ) - observed
+    fold_mean = ( x.sum( axis = 0 ) - x ) / numpy.maximum( fold_observed, 1 )
+
+    # Each held out row, imputed with its fold's means
+    held_out = numpy.where( observed, x, fold_mean )
+
+    # Overall variance of each fold's imputed training rows, for var_smoothing
+    fold_missing = ( n - 1 ) - fold_observed
+    fold_var = ( ( x**2 ).sum( axis = 0 ) - x**2 + fold_missing * fold_mean**2 ) / ( n - 1 ) - fold_mean**2
+    epsilon = var_smoothing * fold_var[ :, panels ].max( axis = 2 ) # n x panels
+
+    jll = []
+    for k in classes:
+        in_class = ( labels == k )
+        row_in_class = in_class[:, numpy.newaxis]
+
+        count = in_class.sum() - in_class
+        class_observed = ( observed & row_in_class ).sum( axis = 0 ) - observed * row_in_class
+        class_missing = count[:, numpy.newaxis] - class_observed
+        class_x = x * row_in_class
+
+        total = class_x.sum( axis = 0 ) - class_x + class_missing * fold_mean
+        total_sq = ( class_x**2 ).sum( axis = 0 ) - class_x**2 + class_missing * fold_mean**2
+        theta = total / count[:, numpy.newaxis]
+        var = total_sq / count[:, numpy.newaxis] - theta**2
+
+        var = var[ :, panels ] + epsilon[:, :, numpy.newaxis] # n x panels x panel size
+        deviation = ( held_out[ :, panels ] - theta[ :, panels ] )**2 / var
+        jll.append(
+            numpy.log( count / ( n - 1 ) )[:, numpy.newaxis]
+            - 0.5 * numpy.sum( numpy.log( 2. * numpy.pi * var ), axis = 2 )
+            - 0.5 * numpy.sum( deviation, axis = 2 ) )
+
+    scores = numpy.exp( jll[-1] - numpy.logaddexp.reduce( jll, axis = 0 ) )
+
+    # Folds whose imputer drops a panel column
+    for j, c in zip( *numpy.nonzero( ( fold_observed == 0 )[ :, panels ].any( axis = 2 ) ) ):
+        train = numpy.delete( numpy.arange( n ), j )
+        normalized_train, normalized_test = mt.normalize_features( features[ numpy.ix_( train, panels[c] ) ], features[ numpy.ix_( [ j ], panels[c] ) ] )
+        model = mt.classifier_factories["nb"]().fit( normalized_train, labels[train] )
+        scores[j, c] = mt.model_scores( model, normalized_test )[0]
+
+    return ( scores )
+
+def warm_start_lr_loo_scores( features, labels, C = 1.0 ):
+    """LOO class 1 probabilities of mean imputation followed by L2 logistic
+    regression, with every fold's lbfgs fit warm-started from the full-data
+    solution. The intercept is fit as the weight of a constant column, so it is
+    penalized as in liblinear and the scores agree with LogisticRegression( C )
+    to within solver tolerance."""
+    from sklearn import linear_model
+    from sklearn.cross_validation import LeaveOneOut
+
+    n = len( features )
+    scores = numpy.zeros( n )
+
+    def with_intercept( x ):
+        return ( numpy.hstack( ( x, numpy.ones( ( len( x ), 1 ) ) ) ) )
+
+    model = linear_model.LogisticRegression( C = C, solver = 'lbfgs', fit_intercept = False, warm_start = True, tol = 1e-6 )
+    model.fit( with_intercept( mt.normalize_features( features ) ), labels )
+    full_coef = model.coef_.copy()
+
+    for j, (train, test) in enumerate( LeaveOneOut( n ) ):
+        normalized_train, normalized_test = mt.normalize_features( features[train], features[test] )
+        model.coef_ = full_coef.copy()
+        model.fit( with_intercept( normalized_train ), labels[train] )
+        scores[j] = model.predict_proba( with_intercept( normalized_test ) )[0,1]
+
+    return ( scores )
+
+def linear_svc_loo_scores( features, labels, classifier, ranking = False ):
+    """LOO scores of mean imputation followed by the linear SVC classifier.
+    With ranking (decision function scores), only the folds that hold out a
+    support vector of the full-data model are refit: without missing values the
+    other folds train on the same data minus a point that does not constrain
+    the solution, so the full-data SVM is their solution too (to within the
+    solver's tolerance). Class 1 probabilities also depend on each fold's Platt
+    calibration, so without ranking every fold is refit."""
+    from sklearn.base import clone
+    from sklearn.cross_validation import LeaveOneOut
+
+    n = len( features )
+    scores = numpy.zeros( n )
+    reuse = ranking and not numpy.isnan( features ).any()
+
+    if reuse:
+        full_model = clone( classifier ).fit( mt.normalize_features( features ), labels )
+        support = numpy.zeros( n, dtype = bool )
+        support[ full_model.support_ ] = True
+
+    for j, (train, test) in enumerate( LeaveOneOut( n ) ):
+        normalized_train, normalized_test = mt.normalize_features( features[train], features[test] )
+        if reuse and not support[j]:
+            model = full_model
+        else:
+            model = clone( classifier ).fit( normalized_train, labels[train] )
+        scores[j] = mt.model_scores( model, normalized_test, ranking )[0]
+
+    return ( scores )
+
+def precomputed_svm_loo_scores( features, labels, classifier, ranking = False ):
+    """LOO scores of a linear or RBF kernel SVC, computing the panel's kernel
+    matrix once and fitting each fold on its slice with kernel = 'precomputed'.
+
+    In this mode missing values are imputed with the column means of all n rows
+    instead of each fold's n-1 rows, so that every fold shares one kernel matrix.
+    This is the only difference from refitting, and there is none when the panel
+    has no missing values. (Inner folds do not scale features, so no other
+    per-fold normalization needs correcting.)"""
+    from sklearn.base import clone
+    from sklearn.cross_validation import LeaveOneOut
+
+    x = mt.normalize_features( features )
+    n, p = x.shape
+    scores = numpy.zeros( n )
+    params = classifier.get_params()
+
+    if params['kernel'] == 'linear':
+        gram = x.dot( x.T )
+    elif params['kernel'] == 'rbf':
+        squared_norms = ( x**2 ).sum( axis = 1 )
+        distances = numpy.clip( squared_norms[:, numpy.newaxis] + squared_norms - 2 * x.dot( x.T ), 0, None )
+        if params['gamma'] == 'scale':
+            # 1 / ( p * variance of the fold's training values ), downdated per fold
+            total = x.sum() - x.sum( axis = 1 )
+            total_sq = ( x**2 ).sum() - squared_norms
+            count = ( n - 1 ) * p
+            gamma = 1 / ( p * ( total_sq / count - ( total / count )**2 ) )
+        else:
+            # Constant gamma: one kernel matrix for every fold
+            gram = numpy.exp( -( 1 / p if params['gamma'] == 'auto' else params['gamma'] ) * distances )
+    else:
+        raise ValueError( 'Precomputed LOO supports linear and rbf kernels, not ' + str( params['kernel'] ) )
+
+    model = clone( classifier ).set_params( kernel = 'precomputed' )
+
+    for j, (train, test) in enumerate( LeaveOneOut( n ) ):
+        if params['kernel'] == 'rbf' and params['gamma'] == 'scale':
+            fold_gram = numpy.exp( -gamma[j] * distances[ numpy.ix_( numpy.append( train, test ), train ) ] )
+            train_gram, test_gram = fold_gram[:-len( test )], fold_gram[-len( test ):]
+        else:
+            train_gram, test_gram = gram[ numpy.ix_( train, train ) ], gram[ numpy.ix_( test, train ) ]
+        model.fit( train_gram, labels[train] )
+        scores[j] = mt.model_scores( model, test_gram, ranking )[0]
+
+    return ( scores )
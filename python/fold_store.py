@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only store of finished outer fold results, for resuming a run
+
+Each run appends ( fold, result ) pickles to one file named by the run's key (a
+hash of the data and configuration), flushing after every fold. A run that is
+restarted with the same key reads the folds already done and only computes the
+rest. A record cut short by a crash is dropped when the store is read. Once the
+run's outputs are written the store is removed, so that it is only ever read by
+a restart of an unfinished run.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import os
+import pickle
+import logging
+
+log = logging.getLogger(__name__)
+
+class FoldStore:
+
+    def __init__( self, directory, key ):
+        os.makedirs( directory, exist_ok = True )
+        self.path = os.path.join( directory, key + '.folds' )
+
+    def load( self ):
+        """Dict from fold to result of the folds stored so far."""
+        results = dict()
+        if not os.path.exists( self.path ):
+            return ( results )
+
+        with open( self.path, 'rb' ) as infile:
+            while True:
+                offset = infile.tell()
+                try:
+                    fold, result = pickle.load( infile )
+                except EOFError:
+                    break
+                except ( pickle.UnpicklingError, ValueError, AttributeError, IndexError ):
+                    log.warning( "Dropping incomplete fold record at byte %d of %s", offset, self.path )
+                    break
+                results[ fold ] = result
+
+        # Cut off a partial record so that new ones append after the last good one
+        if offset < os.path.getsize( self.path ):
+            with open( self.path, 'r+b' ) as outfile:
+                outfile.truncate( offset )
+
+        return ( results )
+
+    def append( self, fold, result ):
+        with open( self.path, 'ab' ) as outfile:
+            pickle.dump( ( fold, result ), outfile )
+            outfile.flush()
+            os.fsync( outfile.fileno() )
+
+    def remove( self ):
+        if os.path.exists( self.path ):
+            os.remove( self.path )
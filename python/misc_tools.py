@@ -8,7 +8,7 @@ Created on Fri Sep 29 14:53:21 2017
 """
 
 import numpy
-from sklearn import ensemble, linear_model, svm, preprocessing, tree, naive_bayes
+import importlib
 
 # Cnstants
 long_names = {
@@ -21,16 +21,33 @@ long_names = {
     "et":"Extremely randomized trees"
 }
 
-classifier_dict = {
-    "lr":linear_model.LogisticRegression(),
-    "lsvc":svm.SVC( kernel = "linear", probability = True ),
-    "rbfsvc":svm.SVC( probability = True ),
-    "nb":naive_bayes.GaussianNB(),
-    "dt":tree.DecisionTreeClassifier(),
-    "rf":ensemble.RandomForestClassifier( n_estimators=100 ),
-    "et":ensemble.ExtraTreesClassifier( n_estimators=100 )
+def estimator( module, name, **params ):
+    """New sklearn.<module>.<name>( **params ). sklearn is only imported by the
+    first factory call, so importing misc_tools stays cheap."""
+    return ( getattr( importlib.import_module( 'sklearn.' + module ), name )( **params ) )
+
+# Factories of unfitted classifiers: every fit gets its own instance, so that
+# fits can run concurrently in threads
+classifier_factories = {
+    "lr":lambda: estimator( 'linear_model', 'LogisticRegression' ),
+    "lsvc":lambda: estimator( 'svm', 'SVC', kernel = "linear", probability = True, random_state = 0 ),
+    "rbfsvc":lambda: estimator( 'svm', 'SVC', probability = True, random_state = 0 ),
+    "nb":lambda: estimator( 'naive_bayes', 'GaussianNB' ),
+    "dt":lambda: estimator( 'tree', 'DecisionTreeClassifier' ),
+    "rf":lambda: estimator( 'ensemble', 'RandomForestClassifier', n_estimators=100 ),
+    "et":lambda: estimator( 'ensemble', 'ExtraTreesClassifier', n_estimators=100 )
+}
+
+# Uncalibrated estimators for methods scored by decision_function when
+# selecting with scoring = "ranking"
+ranking_classifier_factories = {
+    "lsvc":lambda: estimator( 'svm', 'SVC', kernel = "linear" ),
+    "rbfsvc":lambda: estimator( 'svm', 'SVC' )
 }
 
+# Methods whose fit is a deterministic function of the training data
+deterministic_methods = frozenset( [ "lr", "lsvc", "rbfsvc", "nb" ] )
+
 normalization_dict = {
     "lr":"scaled",
     "lsvc":"scaled",
@@ -38,16 +55,16 @@ normalization_dict = {
     "nb":"log"
 }
 
+# L1 selectors for SelectFromModel: these need coef_, so there is no RBF SVC
 feature_selection_C_methods = [
-    lambda C: svm.LinearSVC( C = C, penalty = "l1", dual = False),
-    lambda C: linear_model.LogisticRegression( C = C, penalty = "l1" ),
-    lambda C: svm.SVC( C = C, kernel = "rbf")
+    lambda C: estimator( 'svm', 'LinearSVC', C = C, penalty = "l1", dual = False),
+    lambda C: estimator( 'linear_model', 'LogisticRegression', C = C, penalty = "l1", solver = "liblinear" )
 ]
 
 feature_selection_tree_methods = [
-    tree.DecisionTreeClassifier(),
-    ensemble.RandomForestClassifier(n_estimators=100),
-    ensemble.ExtraTreesClassifier(n_estimators=100)
+    lambda: estimator( 'tree', 'DecisionTreeClassifier' ),
+    lambda: estimator( 'ensemble', 'RandomForestClassifier', n_estimators=100 ),
+    lambda: estimator( 'ensemble', 'ExtraTreesClassifier', n_estimators=100 )
 ]
 
 # Functions
@@ -59,8 +76,16 @@ def unpack( data ):
         list(data)[0:n_features] # feature labels
     )
     
+def model_scores( model, features, ranking = False ):
+    """Class 1 probabilities, or decision function values if ranking"""
+    if ranking:
+        return ( model.decision_function( features ) )
+    return ( model.predict_proba( features )[:,1] )
+
 def normalize_features( train_features, test_features = None, normal = None, mean_impute = True ) :
 
+    from sklearn import preprocessing
+
     if mean_impute:
         imputer = preprocessing.Imputer( strategy = 'mean' )
         train_features = imputer.fit_transform( train_features )
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of inner LOO fits shared between outer LOO folds
+
+Outer fold i's inner fold j trains on all samples except {i, j}, which is the
+same training set as outer fold j's inner fold i. A fold that fits this model
+predicts both held out samples and records both scores, so the other fold can
+read its inner score instead of refitting.
+
+For each (panel, method) every outer fold i writes one record: two arrays over
+all samples k, the score of k and the score of i from the model trained without
+{i, k}. Records are written atomically, so workers can share a directory.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import os
+import numpy
+import hashlib
+import tempfile
+
+class PairFitCache:
+
+    def __init__( self, directory, n_samples ):
+        self.directory = directory
+        self.n_samples = n_samples
+
+    def path( self, panel, method, sample_id ):
+        key = hashlib.sha1( repr( ( tuple( panel ), method ) ).encode() ).hexdigest()
+        return os.path.join( self.directory, '{}-{}.npy'.format( key, sample_id ) )
+
+    def new_record( self ):
+        return numpy.full( ( 2, self.n_samples ), numpy.nan )
+
+    def get( self, panel, method, sample_id ):
+        """Record written by outer fold sample_id: row 0 holds the scores of the
+        partners, row 1 the scores of sample_id. None if not written yet."""
+        try:
+            return numpy.load( self.path( panel, method, sample_id ) )
+        except FileNotFoundError:
+            return None
+
+    def put( self, panel, method, sample_id, record ):
+        fd, tmp_path = tempfile.mkstemp( dir = self.directory, suffix = '.tmp' )
+        with os.fdopen( fd, 'wb' ) as outfile:
+            numpy.save( outfile, record )
+        os.replace( tmp_path, self.path( panel, method, sample_id ) )
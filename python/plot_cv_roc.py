@@ -4,14 +4,19 @@ Created on Mon Sep  4 11:11:37 2017
 
 Analyzing results
 
+Usage: plot_cv_roc.py results output.pdf [t]
+
+results is a columnar result directory (see result_format.py), of which only
+the score, label, method and panel columns are read, or a pickle.
+
 @author: Yuriy Sverchkov
 """
 
 import logging
 import analysis_utilities
 import numpy
+import result_format
 from sys import argv
-from pickle import load
 
 # Global constants
 logging.basicConfig( level = logging.INFO )
@@ -30,7 +35,10 @@ def inc( count_dict, key ):
 def plot_roc_curve( result_list, title = None, output_filename = None ):
 
     scores, labels = map( lambda x : numpy.squeeze( numpy.array( x ) ), zip( * [ (r['score'], r['label']) for r in result_list ] ) )
-    
+    plot_roc_scores( scores, labels, title, output_filename )
+
+def plot_roc_scores( scores, labels, title = None, output_filename = None ):
+
     log.debug( 'Scores for ROC "'+str(title) + '": '+str(scores) )
     log.debug( 'Labels for ROC "'+str(title) + '": '+str(labels) )
 
@@ -89,8 +97,13 @@ if __name__ == '__main__':
     else:
         maketitle = None
 
-    with open( results_filename, 'rb' ) as infile:
-        result = load( infile )
+    if result_format.is_columnar( results_filename ):
+        scores, labels = result_format.read_columns( results_filename, 'score', 'label' )
+        methods, panels = ( result_format.read_fold_values( results_filename, name ) for name in ( 'method', 'panel' ) )
+        result = [ { 'method': method, 'panel': panel } for method, panel in zip( methods, panels ) ]
+    else:
+        result = result_format.load( results_filename )
+        scores, labels = map( lambda x : numpy.squeeze( numpy.array( x ) ), zip( * [ (r['score'], r['label']) for r in result ] ) )
 
     panel_size = len( result[0]['panel'] )
 
@@ -99,6 +112,6 @@ if __name__ == '__main__':
     else:
         title = ''
 
-    plot_roc_curve( result, title = title, output_filename = pdf_filename )
+    plot_roc_scores( numpy.asarray( scores ), numpy.asarray( labels ), title = title, output_filename = pdf_filename )
     method, panel = get_best_method_panel( result )
     log.info( 'Best method, panel: '+str( (method, panel ) ) )
@@ -4,13 +4,19 @@ Created on Wed Sep  6 16:54:04 2017
 
 Command line utility for making Validation ROC plot
 
+Usage: plot_val_roc.py result output.pdf [t]
+
+result is a columnar result directory (see result_format.py), of which only
+the score, label, method and panel columns are read, or a pickle.
+
 @author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
 """
 
 import analysis_utilities
 import logging
+import numpy
+import result_format
 from sys import argv
-from pickle import load
 from misc_tools import long_names
 
 # Global constants
@@ -32,8 +38,12 @@ if __name__ == '__main__':
 
 
     
-    with open( infilename, 'rb' ) as infile:
-        result = load( infile )
+    if result_format.is_columnar( infilename ):
+        scores, labels = result_format.read_columns( infilename, 'score', 'label' )
+        result = { name: result_format.read_fold_values( infilename, name )[0] for name in ( 'method', 'panel' ) }
+        result['score'], result['label'] = numpy.asarray( scores ), numpy.asarray( labels )
+    else:
+        result = result_format.load( infilename )
 
     if withtitle == 't':
         title = "Model: "+long_names[result['method']]+"\nPanel: "+str(result['panel'])
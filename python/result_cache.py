@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache of analysis results
+
+Results are stored under a hash of their inputs (data, panel size, selection
+options, classifier configuration) and of the code that computes them, so a
+rerun with identical inputs returns the stored result however the input files'
+timestamps changed. Each entry is a pickle with a small JSON description beside
+it; the description is written first, so an entry exists once its pickle does.
+The least recently used entries are evicted to keep the cache under its size
+bound.
+
+Usage: result_cache.py cache_directory list
+       result_cache.py cache_directory prune max_bytes
+       result_cache.py cache_directory remove key [key ...]
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import os
+import json
+import time
+import pickle
+import logging
+import tempfile
+import content_hash
+from sys import argv
+
+log = logging.getLogger(__name__)
+
+class ResultCache:
+
+    def __init__( self, directory, max_bytes = None ):
+        os.makedirs( directory, exist_ok = True )
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key( self, *inputs ):
+        return ( content_hash.digest( *inputs, content_hash.code_version() ) )
+
+    def path( self, key, extension ):
+        return ( os.path.join( self.directory, key + extension ) )
+
+    def get( self, key ):
+        """Stored result, or None on a miss. A hit counts as a use for eviction."""
+        try:
+            with open( self.path( key, '.pkl' ), 'rb' ) as infile:
+                result = pickle.load( infile )
+        except FileNotFoundError:
+            return ( None )
+        try:
+            os.utime( self.path( key, '.json' ) )
+        except FileNotFoundError:
+            # A pickle without its description is left by an interrupted remove
+            self.remove( key )
+            return ( None )
+        log.debug( "Result cache hit %s", key )
+        return ( result )
+
+    def put( self, key, result, description = '' ):
+        # The pickle goes last: it marks the entry complete
+        for extension, write in (
+                ( '.json', lambda outfile: outfile.write( json.dumps( { 'description': description, 'created': time.time() } ).encode() ) ),
+                ( '.pkl', lambda outfile: pickle.dump( result, outfile ) ) ):
+            fd, tmp_path = tempfile.mkstemp( dir = self.directory, suffix = '.tmp' )
+            with os.fdopen( fd, 'wb' ) as outfile:
+                write( outfile )
+            os.replace( tmp_path, self.path( key, extension ) )
+
+        if self.max_bytes is not None:
+            self.prune( self.max_bytes )
+
+    def entries( self ):
+        """List of ( key, bytes, last used time, description ), most recently used first."""
+        entries = []
+        for filename in os.listdir( self.directory ):
+            key, extension = os.path.splitext( filename )
+            if extension != '.json' or not os.path.exists( self.path( key, '.pkl' ) ):
+                continue
+            with open( self.path( key, '.json' ) ) as infile:
+                description = json.load( infile )[ 'description' ]
+            entries.append( ( key, os.path.getsize( self.path( key, '.pkl' ) ), os.path.getmtime( self.path( key, '.json' ) ), description ) )
+        return ( sorted( entries, key = lambda entry: -entry[2] ) )
+
+    def remove( self, key ):
+        for extension in ( '.pkl', '.json' ):
+            try:
+                os.remove( self.path( key, extension ) )
+            except FileNotFoundError:
+                pass
+
+    def prune( self, max_bytes ):
+        """Evict least recently used entries until the total is at most max_bytes."""
+        total = 0
+        for key, size, used, description in self.entries():
+            total += size
+            if total > max_bytes:
+                log.debug( "Evicting %s (%s)", key, description )
+                self.remove( key )
+
+# Main run
+if __name__ == '__main__':
+
+    logging.basicConfig( level = logging.DEBUG )
+
+    cache = ResultCache( argv[1] )
+    command = argv[2]
+
+    if command == 'list':
+        entries = cache.entries()
+        for key, size, used, description in entries:
+            print( '{}  {:>12}  {}  {}'.format( key, size, time.strftime( '%Y-%m-%d %H:%M', time.localtime( used ) ), description ) )
+        print( '{} entries, {} bytes'.format( len( entries ), sum( entry[1] for entry in entries ) ) )
+    elif command == 'prune':
+        cache.prune( int( argv[3] ) )
+    elif command == 'remove':
+        for key in argv[3:]:
+            cache.remove( key )
+    else:
+        raise ValueError( 'Unknown command ' + command )
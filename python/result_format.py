@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar on-disk format of pipeline results
+
+A result set (the list of fold results of a CV run, or the single result of a
+validation run) is stored as a directory, conventionally named *.cols, of .npy
+files that readers can memory-map one at a time:
+
+ score.npy, label.npy   test scores and labels, one row per test sample
+ fold.npy               the fold (index into the result list) of each row
+ <name>.npy             one row per fold: numbers as they are, and strings or
+                        panels as codes into dictionary.json
+ inner_scores.npy, inner_labels.npy, inner_offsets.npy
+                        the inner LOO scores and labels of all folds back to
+                        back; fold i's are rows inner_offsets[i]:inner_offsets[i+1]
+ random_state.npz       the numpy random states of the folds
+ dictionary.json        the dictionaries of the encoded columns and the layout
+
+Usage: result_format.py results.pkl [results.cols]
+
+converts a pickled result set to this format.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import os
+import json
+import numpy
+import pickle
+import shutil
+import tempfile
+from sys import argv
+
+row_columns = ( 'score', 'label' )
+inner_columns = ( 'inner_scores', 'inner_labels' )
+
+def is_columnar( path ):
+    return ( os.path.isdir( path ) )
+
+def save( path, results ):
+    """Save results in the columnar format if path ends in .cols, and as a
+    pickle otherwise."""
+    if path.endswith( '.cols' ):
+        write_columns( path, results )
+    else:
+        with open( path, 'wb' ) as outfile:
+            pickle.dump( results, outfile )
+
+def load( path ):
+    """Results as saved, from either format."""
+    if is_columnar( path ):
+        return ( read_results( path ) )
+    with open( path, 'rb' ) as infile:
+        return ( pickle.load( infile ) )
+
+def write_columns( path, results ):
+    """Write results to a temporary sibling directory that then replaces path,
+    so that an interrupted write never leaves a partial or stale result set."""
+
+    path = os.path.normpath( path )
+    tmp_path = tempfile.mkdtemp( dir = os.path.dirname( os.path.abspath( path ) ), prefix = os.path.basename( path ) + '.', suffix = '.tmp' )
+    try:
+        write_column_files( tmp_path, results )
+        if os.path.exists( path ):
+            # Directories can only be replaced when empty: move the old one aside
+            old_path = tempfile.mkdtemp( dir = os.path.dirname( tmp_path ), prefix = os.path.basename( path ) + '.', suffix = '.old' )
+            os.replace( path, old_path )
+            os.replace( tmp_path, path )
+            shutil.rmtree( old_path )
+        else:
+            os.replace( tmp_path, path )
+    except BaseException:
+        shutil.rmtree( tmp_path, ignore_errors = True )
+        raise
+
+def write_column_files( path, results ):
+
+    single = isinstance( results, dict )
+    folds = [ results ] if single else results
+
+    def save_column( name, values ):
+        numpy.save( os.path.join( path, name + '.npy' ), values )
+
+    # Rows
+    for name in row_columns:
+        save_column( name, numpy.concatenate( [ numpy.ravel( fold[ name ] ) for fold in folds ] ) )
+    save_column( 'fold', numpy.concatenate( [ numpy.full( numpy.size( fold['score'] ), i, dtype = numpy.int32 ) for i, fold in enumerate( folds ) ] ) )
+
+    # Inner LOO blobs
+    for name in inner_columns:
+        save_column( name, numpy.concatenate( [ numpy.ravel( fold[ name ] ) for fold in folds ] ) )
+    save_column( 'inner_offsets', numpy.cumsum( [ 0 ] + [ numpy.size( fold['inner_scores'] ) for fold in folds ] ) )
+
+    # Random states, as ( name, keys, pos, has_gauss, cached_gaussian ) tuples
+    states = [ fold['random_state'] for fold in folds ]
+    numpy.savez( os.path.join( path, 'random_state.npz' ), *[ numpy.array( [ state[k] for state in states ] ) for k in range( 1, 5 ) ] )
+
+    # Fold columns, dictionary encoded unless numeric
+    dictionaries, numeric = dict(), []
+    for name in folds[0]:
+        if name in row_columns + inner_columns + ( 'random_state', ):
+            continue
+        values = [ fold[ name ] for fold in folds ]
+        if all( isinstance( value, ( int, float, numpy.number ) ) for value in values ):
+            save_column( name, numpy.array( values ) )
+            numeric.append( name )
+        else:
+            values = [ list( value ) if isinstance( value, ( list, tuple ) ) else value for value in values ]
+            dictionary = []
+            for value in values:
+                if value not in dictionary:
+                    dictionary.append( value )
+            save_column( name, numpy.array( [ dictionary.index( value ) for value in values ], dtype = numpy.int32 ) )
+            dictionaries[ name ] = dictionary
+
+    with open( os.path.join( path, 'dictionary.json' ), 'w' ) as outfile:
+        json.dump( {
+            'single': single,
+            'random_state': states[0][0],
+            'numeric': numeric,
+            'dictionaries': dictionaries }, outfile )
+
+def read_layout( path ):
+    with open( os.path.join( path, 'dictionary.json' ) ) as infile:
+        return ( json.load( infile ) )
+
+def read_columns( path, *names ):
+    """Memory-mapped arrays of the named columns."""
+    return ( tuple( numpy.load( os.path.join( path, name + '.npy' ), mmap_mode = 'r' ) for name in names ) )
+
+def read_fold_values( path, name ):
+    """List of the folds' values of a fold column, decoded."""
+    layout = read_layout( path )
+    codes, = read_columns( path, name )
+    if name in layout['dictionaries']:
+        return ( [ layout['dictionaries'][ name ][ code ] for code in codes ] )
+    return ( codes.tolist() )
+
+def read_results( path ):
+    """The full result set, as it was saved."""
+
+    layout = read_layout( path )
+    fold, inner_offsets = read_columns( path, 'fold', 'inner_offsets' )
+    n_folds = len( inner_offsets ) - 1
+    folds = [ dict() for i in range( n_folds ) ]
+
+    for name in row_columns:
+        values, = read_columns( path, name )
+        for i in range( n_folds ):
+            folds[i][ name ] = numpy.array( values[ fold == i ] )
+
+    for name in inner_columns:
+        values, = read_columns( path, name )
+        for i in range( n_folds ):
+            folds[i][ name ] = numpy.array( values[ inner_offsets[i]:inner_offsets[i+1] ] ).reshape( -1, 1 )
+
+    with numpy.load( os.path.join( path, 'random_state.npz' ) ) as states:
+        parts = [ states[ 'arr_{}'.format( k ) ] for k in range( 4 ) ]
+        for i in range( n_folds ):
+            folds[i]['random_state'] = ( layout['random_state'], parts[0][i], int( parts[1][i] ), int( parts[2][i] ), float( parts[3][i] ) )
+
+    for name in layout['numeric'] + list( layout['dictionaries'] ):
+        for i, value in enumerate( read_fold_values( path, name ) ):
+            folds[i][ name ] = value
+
+    return ( folds[0] if layout['single'] else folds )
+
+# Main run
+if __name__ == '__main__':
+
+    input_filename = argv[1]
+    output_filename = argv[2] if len( argv ) > 2 else os.path.splitext( input_filename )[0] + '.cols'
+
+    with open( input_filename, 'rb' ) as infile:
+        write_columns( output_filename, pickle.load( infile ) )
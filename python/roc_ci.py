@@ -6,11 +6,16 @@ Implementation of confidence bands for ROC curves according to Tilbury et al.(20
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
 from math import lgamma, log
 from functools import reduce
-from skimage.morphology import convex_hull_image
-from scipy.spatial import ConvexHull
+from collections import namedtuple
+
+# matplotlib, scipy and scikit-image are imported by the functions that use
+# them: the pipeline only needs rocstats and max_tpr_at_fpr from this module.
+
+# A sub-block of a surface on a larger grid: values[i,j] is cell
+# ( row_offset + i, col_offset + j ) of a grid with the given full shape.
+SurfaceBlock = namedtuple( 'SurfaceBlock', [ 'values', 'row_offset', 'col_offset', 'shape' ] )
 
 def subexp( lnX, lnY ):
     # x-y = exp( log( 1-y/x ) + log x ) = exp( log( 1 - exp( lnY - lnX ) ) + lnX )
@@ -32,7 +37,44 @@ def ln_boundary_value( a0, a1, p ):
                 - lgamma( k + 1) - lgamma( a0 + a1 + 2 - k )
                 for k in range( a1 + 1 ) ], -np.inf )
 
-def boundary_matrix( a0, a1, b0, b1, n, sorting_fix = True ):
+def boundary_vector( a0, a1, n, start = 0, stop = None ):
+    # exp( ln_boundary_value( a0, a1, p ) ) is the Beta( a0+1, a1+1 ) CDF at p,
+    # which is the regularized incomplete beta function I_p( a0+1, a1+1 ).
+    # Returns the mass of grid cells start to stop-1 of n.
+    from scipy.special import betainc
+    i = np.arange( start, ( n if stop is None else stop ) + 1 )
+    lower = betainc( a0 + 1, a1 + 1, i / n )
+    upper = betainc( a1 + 1, a0 + 1, ( n - i ) / n ) # 1 - lower, computed directly
+
+    # Differencing the smaller tail avoids cancellation where the CDF is near 1,
+    # and clipping keeps the cells non-negative as the sorting fix does.
+    cells = np.where( lower[:-1] > 0.5, upper[:-1] - upper[1:], lower[1:] - lower[:-1] )
+    return np.clip( cells, 0, None )
+
+def boundary_window( a0, a1, n, tail = 1e-6 ):
+    """Range [start, stop) of the n grid cells holding all but tail of the
+    boundary mass on either side."""
+    from scipy.special import betaincinv
+    start = int( np.floor( betaincinv( a0 + 1, a1 + 1, tail ) * n ) )
+    stop = int( np.ceil( betaincinv( a0 + 1, a1 + 1, 1 - tail ) * n ) )
+    start = min( max( start, 0 ), n-1 )
+    return ( start, min( max( stop, start+1 ), n ) )
+
+def boundary_block( a0, a1, b0, b1, n, tail = 1e-6, dtype = np.float64 ):
+    """The part of boundary_matrix( a0, a1, b0, b1, n ) where the mass lives,
+    as a SurfaceBlock."""
+    x_start, x_stop = boundary_window( a0, a1, n, tail )
+    y_start, y_stop = boundary_window( b0, b1, n, tail )
+    x = boundary_vector( a0, a1, n, x_start, x_stop ).astype( dtype )
+    y = boundary_vector( b0, b1, n, y_start, y_stop ).astype( dtype )
+    return SurfaceBlock( np.outer( y, x ), y_start, x_start, ( n, n ) )
+
+def boundary_matrix( a0, a1, b0, b1, n, sorting_fix = True, vectorized = True, dtype = np.float64 ):
+
+    if vectorized :
+        x = np.asmatrix( boundary_vector( a0, a1, n ).astype( dtype ) )
+        y = np.asmatrix( boundary_vector( b0, b1, n ).astype( dtype ) )
+        return y.T * x
 
     x_b = [ ln_boundary_value( a0, a1, i/n ) for i in range( n+1 ) ]
     y_b = [ ln_boundary_value( b0, b1, i/n ) for i in range( n+1 ) ]
@@ -54,10 +96,96 @@ def boundary_matrix( a0, a1, b0, b1, n, sorting_fix = True ):
     # y = p( true positive )
     # x = p( false alarm )    
     
-    return y.T * x
+    return ( y.T * x ).astype( dtype )
     
 
 def rocstats( scores, labels ):
+    """TP, FP, FN and TN counts at every distinct score threshold (and -inf).
+
+    A sample counts as a predicted positive at threshold t when its score is
+    strictly greater than t. Thresholds are in increasing order."""
+
+    scores = np.ravel( np.asarray( scores, dtype = float ) )
+    labels = np.ravel( np.asarray( labels ) ).astype( bool )
+
+    thresholds = np.unique( np.append( scores, -np.inf ) )
+
+    # Number of positives/negatives scoring at or below each threshold
+    fn = np.searchsorted( np.sort( scores[labels] ), thresholds, side = 'right' )
+    tn = np.searchsorted( np.sort( scores[~labels] ), thresholds, side = 'right' )
+    tp = np.count_nonzero( labels ) - fn
+    fp = np.count_nonzero( ~labels ) - tn
+
+    return ( tp, fp, fn, tn )
+
+def roc_stats_from_counts( positives, negatives ):
+
+    positives = np.asarray( positives )
+    negatives = np.asarray( negatives )
+
+    tp = np.concatenate( ( [0], np.cumsum( positives ) ) )
+    fp = np.concatenate( ( [0], np.cumsum( negatives ) ) )
+    fn = np.sum( positives ) - tp
+    tn = np.sum( negatives ) - fp
+
+    return ( tp, fp, fn, tn )
+
+def max_tpr_at_fpr( score_matrix, labels, max_fpr, partial_auc = False ):
+    """Max TPR subject to FPR <= max_fpr for each column of an
+    (n_samples x n_candidates) score matrix, sharing one label vector.
+
+    Thresholds are handled as in rocstats: tied scores are never split.
+    If partial_auc is True, also returns the area under each ROC curve
+    over FPR in [0, max_fpr]."""
+
+    scores = np.asarray( score_matrix, dtype = float )
+    if scores.ndim == 1:
+        scores = scores[:, np.newaxis]
+    labels = np.ravel( np.asarray( labels ) ).astype( bool )
+    n, n_candidates = scores.shape
+
+    # Sort each column by decreasing score; cut k predicts the top k positive
+    order = np.argsort( -scores, axis = 0, kind = 'stable' )
+    sorted_scores = np.take_along_axis( scores, order, axis = 0 )
+    sorted_labels = labels[order]
+
+    zeros = np.zeros( ( 1, n_candidates ), dtype = int )
+    tp = np.concatenate( ( zeros, np.cumsum( sorted_labels, axis = 0 ) ) )
+    fp = np.concatenate( ( zeros, np.cumsum( ~sorted_labels, axis = 0 ) ) )
+
+    # A cut is a valid threshold only at the end of a group of tied scores
+    valid = np.ones( ( n+1, n_candidates ), dtype = bool )
+    valid[1:n] = sorted_scores[:-1] != sorted_scores[1:]
+
+    with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        tpr = np.divide( tp, np.count_nonzero( labels ) )
+        fpr = np.divide( fp, np.count_nonzero( ~labels ) )
+
+    best = np.max( np.where( valid & ( fpr <= max_fpr ), tpr, -np.inf ), axis = 0 )
+
+    if not partial_auc:
+        return best
+
+    # Move points inside a tie group to the group's end so that ties are
+    # traced as diagonal segments
+    group_end = np.where( valid, np.arange( n+1 )[:, np.newaxis], n )
+    group_end = np.minimum.accumulate( group_end[::-1], axis = 0 )[::-1]
+    x = np.take_along_axis( fpr, group_end, axis = 0 )
+    y = np.take_along_axis( tpr, group_end, axis = 0 )
+
+    # Trapezoids clipped to [0, max_fpr]
+    x0, x1, y0, y1 = x[:-1], x[1:], y[:-1], y[1:]
+    x_end = np.clip( x1, None, max_fpr )
+    width = np.clip( x_end - x0, 0, None )
+    with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        y_end = np.where( x1 > x0, y0 + ( y1 - y0 ) * ( x_end - x0 ) / ( x1 - x0 ), y1 )
+    pauc = np.sum( width * ( y0 + y_end ) / 2, axis = 0 )
+
+    return ( best, pauc )
+
+# Reference (loop) implementations of the above, used for validation only
+
+def rocstats_loop( scores, labels ):
 
     sorted_scores = np.unique( np.append( scores, -np.inf ) )
     tp = []
@@ -74,7 +202,7 @@ def rocstats( scores, labels ):
 
     return ( tp, fp, fn, tn )
 
-def roc_stats_from_counts( positives, negatives ):
+def roc_stats_from_counts_loop( positives, negatives ):
     tp = []
     fp = []
     fn = []
@@ -88,10 +216,56 @@ def roc_stats_from_counts( positives, negatives ):
         
     return ( tp, fp, fn, tn )
 
-def roc_surfaces( tp, fp, fn, tn, n=50 ):
-    return [ boundary_matrix( a0, a1, b0, b1, n )
-        for a0, a1, b0, b1
-        in zip( fp, tn, tp, fn ) ]
+def confidence_blob_loop( p_matrix, confidence = 0.95 ):
+    lnconfidence = np.log( confidence )
+    m, n = p_matrix.shape
+    p_array = sorted( zip( np.log( np.reshape( np.asarray( p_matrix ), -1 ) ), range( m*n ) ), reverse = True )
+    bin_array = [False] * (m*n)
+    lnsum = None
+    for lnp, i in p_array :
+        if lnsum is not None and lnsum > lnconfidence :
+            break
+        bin_array[i] = True
+        if lnsum is None:
+            lnsum = lnp
+        else:
+            lnsum = np.logaddexp( lnsum, lnp )
+        
+    return np.reshape( bin_array, (m, n) )
+
+def get_hull_from_blob_loop( blob ):
+    from scipy.spatial import ConvexHull
+    
+    # Get x&y
+    m, n = blob.shape
+    x = [ i/m for _ in range( n ) for i in range( m ) ]
+    y = [ i/n for i in range( n ) for _ in range( m ) ]
+    
+    # Make a point set
+    points = np.reshape( blob, -1 )
+    x_points = np.concatenate( [ [ x_i, x_i, x_i + 1/m, x_i + 1/m ] for x_i, p in zip( x, points) if p ] )
+    y_points = np.concatenate( [ [ y_i, y_i + 1/n, y_i, y_i + 1/m ] for y_i, p in zip( y, points) if p ] )
+    
+    # Get hull
+    return ConvexHull( np.stack( [x_points, y_points], axis = 1 ) )
+
+def iter_roc_surfaces( tp, fp, fn, tn, n=50, vectorized = True, dtype = np.float64, adaptive = False, tail = 1e-6 ):
+    """Generate the confidence surfaces of the ROC points one at a time.
+    If adaptive, generate only the SurfaceBlock where the mass lives."""
+    for a0, a1, b0, b1 in zip( fp, tn, tp, fn ):
+        if adaptive:
+            yield boundary_block( a0, a1, b0, b1, n, tail, dtype )
+        else:
+            yield boundary_matrix( a0, a1, b0, b1, n, vectorized = vectorized, dtype = dtype )
+
+def roc_surfaces( tp, fp, fn, tn, n=50, vectorized = True, dtype = np.float64 ):
+    return list( iter_roc_surfaces( tp, fp, fn, tn, n, vectorized, dtype ) )
+
+def iter_roc_hulls( tp, fp, fn, tn, n=50, confidence = 0.95, dtype = np.float64, adaptive = False ):
+    """Generate the confidence region hull of each ROC point, keeping only one
+    surface in memory at a time."""
+    for surface in iter_roc_surfaces( tp, fp, fn, tn, n, dtype = dtype, adaptive = adaptive ):
+        yield get_hull_from_blob( confidence_blob( surface, confidence ) )
 
 def rocci( scores, labels, n = 50 ):
     
@@ -100,6 +274,7 @@ def rocci( scores, labels, n = 50 ):
     return roc_surfaces( tp, fp, fn, tn, n )
     
 def plot_heatmap( heat_matrix, tpr=None, fpr=None ):
+    import matplotlib.pyplot as plt
 
     n = len( heat_matrix )
     indeces = [ i/n for i in range( n + 1 ) ]
@@ -115,54 +290,76 @@ def plot_heatmap( heat_matrix, tpr=None, fpr=None ):
     plt.close
     
 def plot_heatmap_only( heat_matrix ):
+    import matplotlib.pyplot as plt
     m, n = heat_matrix.shape
     y = [ i/n for i in range( n + 1 ) ]
     x = [ i/m for i in range( m + 1 ) ]
     return plt.pcolormesh( x, y, np.asarray( heat_matrix ), cmap=plt.cm.Blues )
     
 def confidence_blob( p_matrix, confidence = 0.95 ):
+    if isinstance( p_matrix, SurfaceBlock ):
+        return p_matrix._replace( values = confidence_blob( p_matrix.values, confidence ) )
+    return confidence_blobs( np.asarray( p_matrix )[np.newaxis], confidence )[0]
+
+def confidence_blobs( p_stack, confidence = 0.95 ):
+    """Smallest sets of highest-probability cells holding the confidence mass,
+    for a (k x m x n) stack of surfaces.
+
+    Cells are taken in decreasing order of probability, equal probabilities in
+    decreasing order of flat index (as when sorting (log p, index) pairs in
+    reverse), until the mass taken before a cell exceeds the confidence."""
     lnconfidence = np.log( confidence )
-    m, n = p_matrix.shape
-    p_array = sorted( zip( np.log( np.reshape( np.asarray( p_matrix ), -1 ) ), range( m*n ) ), reverse = True )
-    bin_array = [False] * (m*n)
-    lnsum = None
-    for lnp, i in p_array :
-        if lnsum is not None and lnsum > lnconfidence :
-            break
-        bin_array[i] = True
-        if lnsum is None:
-            lnsum = lnp
-        else:
-            lnsum = np.logaddexp( lnsum, lnp )
-        
-    return np.reshape( bin_array, (m, n) )
+    p_stack = np.asarray( p_stack )
+    k, m, n = p_stack.shape
+    with np.errstate( divide = 'ignore' ):
+        lnp = np.log( np.reshape( p_stack, ( k, m*n ) ) )
+
+    order = np.argsort( lnp, axis = 1, kind = 'stable' )[:, ::-1]
+    lnsum = np.logaddexp.accumulate( np.take_along_axis( lnp, order, axis = 1 ), axis = 1 )
+    counts = np.minimum( np.count_nonzero( lnsum <= lnconfidence, axis = 1 ) + 1, m*n )
+
+    blobs = np.zeros( ( k, m*n ), dtype = bool )
+    np.put_along_axis( blobs, order, np.arange( m*n ) < counts[:, np.newaxis], axis = 1 )
+    return np.reshape( blobs, ( k, m, n ) )
 
 def confidence_band( surfaces, confidence = 0.95 ):
+    from skimage.morphology import convex_hull_image
     
     if len( surfaces ) < 2:
         return confidence_blob( surfaces[0], confidence )
         
-    blobs = list( map( lambda x: confidence_blob( x, confidence ), surfaces ) )
+    blobs = list( confidence_blobs( np.stack( [ np.asarray( s ) for s in surfaces ] ), confidence ) )
     pairs = map( np.maximum, blobs[:-1], blobs[1:] )
     segments = map( convex_hull_image, pairs )
     return reduce( np.maximum, segments )
 
 def get_hull_from_blob( blob ):
-    
-    # Get x&y
+    """Convex hull of the True cells of a blob (array or SurfaceBlock). Rows of
+    the blob are the y (TPR) axis and columns the x (FPR) axis."""
+    from scipy.spatial import ConvexHull
+
+    if not isinstance( blob, SurfaceBlock ):
+        blob = SurfaceBlock( blob, 0, 0, np.shape( blob ) )
     m, n = blob.shape
-    x = [ i/m for _ in range( n ) for i in range( m ) ]
-    y = [ i/n for i in range( n ) for _ in range( m ) ]
-    
-    # Make a point set
-    points = np.reshape( blob, -1 )
-    x_points = np.concatenate( [ [ x_i, x_i, x_i + 1/m, x_i + 1/m ] for x_i, p in zip( x, points) if p ] )
-    y_points = np.concatenate( [ [ y_i, y_i + 1/n, y_i, y_i + 1/m ] for y_i, p in zip( y, points) if p ] )
+    values = np.asarray( blob.values, dtype = bool )
+
+    # Only the first and last True cell of each row can give hull corners
+    rows = np.flatnonzero( values.any( axis = 1 ) )
+    first = np.argmax( values[rows], axis = 1 )
+    last = values.shape[1] - 1 - np.argmax( values[rows, ::-1], axis = 1 )
+
+    x_left = ( first + blob.col_offset ) / n
+    x_right = ( last + 1 + blob.col_offset ) / n
+    y_low = ( rows + blob.row_offset ) / m
+    y_high = ( rows + 1 + blob.row_offset ) / m
+    x_points = np.concatenate( [ x_left, x_left, x_right, x_right ] )
+    y_points = np.concatenate( [ y_low, y_high, y_low, y_high ] )
     
     # Get hull
     return ConvexHull( np.stack( [x_points, y_points], axis = 1 ) )
 
 def plot_hull( hull, invert_x = False ):
+    import matplotlib.pyplot as plt
     
     x = hull.points[ hull.vertices, 0 ]
     y = hull.points[ hull.vertices, 1 ]
@@ -173,6 +370,7 @@ def plot_hull( hull, invert_x = False ):
     return plt.plot( x, y, color = '0.8' )
 
 def plot_hulls( surfaces, invert_x = False, confidence = 0.95 ):
+    # surfaces may be a generator, e.g. from iter_roc_surfaces
     for surface in surfaces :
         plot_hull( get_hull_from_blob( confidence_blob( surface, confidence ) ), invert_x )
 
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Run a batch of cross-validation and validation jobs on one worker pool
+
+Usage: run_batch.py manifest.csv [options]
+
+manifest.csv has the columns training, validation, panel_size and output, with
+one row per output file. Rows with an empty validation are CV jobs (as run by
+run_cv_analysis.py) and the others validation jobs (as run by
+run_val_analysis.py); the outputs are the same. CV rows with the same training
+CSV run as one outer LOO over all their panel sizes.
+
+Each CSV is read once and published to a single warm pool, and all jobs are
+driven concurrently on it, so that their tasks interleave and keep the workers
+busy. The options are those of run_cv_analysis.py and apply to every job.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import logging
+import tempfile
+import shared_data
+import result_format
+import analysis_pipeline
+from argparse import ArgumentParser
+from misc_tools import unpack
+from concurrent.futures import ThreadPoolExecutor
+from run_cv_analysis import add_selection_arguments, selection_options, coordinator_options, store_directory, result_cache
+
+# Global constants
+logging.basicConfig( level = logging.DEBUG )
+log = logging.getLogger(__name__)
+log.setLevel( logging.DEBUG )
+
+def validation_job( pool, args, panel_size, training_dataset, validation_dataset, training_data, validation_data, output_filename ):
+    """Runs core_pipeline on pool. The result cache is on this host, so it is
+    looked up and filled here and only the computation goes to the pool."""
+    options = selection_options( args )
+    cache = result_cache( args, output_filename )
+    result = None
+
+    if cache is not None:
+        train_features, train_labels, feature_labels = unpack( training_data )
+        test_features, test_labels, _ = unpack( validation_data )
+        key = analysis_pipeline.core_key( cache, train_features, train_labels, test_features, test_labels, feature_labels, panel_size, None, options )
+        result = cache.get( key )
+
+    if result is None:
+        result = pool.apply( analysis_pipeline.shared_core_pipeline, ( panel_size, training_dataset, validation_dataset ), options )
+        if cache is not None:
+            cache.put( key, result, output_filename )
+
+    result_format.save( output_filename, result )
+    log.debug( "Saved %s", output_filename )
+
+# Main run
+if __name__ == '__main__':
+
+    from pandas import read_csv, isnull
+
+    parser = ArgumentParser( description = 'Run a batch of cross-validation and validation jobs' )
+    parser.add_argument( 'manifest_filename' )
+    add_selection_arguments( parser )
+    args = parser.parse_args()
+
+    manifest = read_csv( args.manifest_filename, dtype = { 'training': str, 'validation': str, 'panel_size': int, 'output': str } )
+    jobs = [ ( row.training, None if isnull( row.validation ) else row.validation, row.panel_size, row.output ) for row in manifest.itertuples() ]
+
+    # CV jobs grouped by training CSV
+    cv_groups = dict()
+    for training, validation, panel_size, output in jobs:
+        if validation is None:
+            cv_groups.setdefault( training, dict() )[ panel_size ] = output
+
+    # Every CSV read once, and published under its own dataset name
+    filenames = sorted( set( filename for job in jobs for filename in job[:2] if filename is not None ) )
+    datasets = { filename: 'd{}-'.format( i ) for i, filename in enumerate( filenames ) }
+    data = { filename: read_csv( filename ) for filename in filenames }
+
+    for training, validation, panel_size, output in jobs:
+        if validation is not None and unpack( data[ training ] )[2] != unpack( data[ validation ] )[2]:
+            log.error( "Feature labels don't match up between %s and %s.", training, validation )
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        shared = dict()
+        for filename in filenames:
+            features, labels, feature_labels = unpack( data[ filename ] )
+            shared.update( shared_data.publish( directory, datasets[ filename ], features = features, labels = labels, feature_labels = feature_labels ) )
+
+        with analysis_pipeline.new_pool( args.processes, args.backend, shared, coordinator_options( args ) ) as pool, ThreadPoolExecutor( max( len( jobs ), 1 ) ) as drivers:
+
+            running = [ drivers.submit( analysis_pipeline.run_analysis_pipeline_sizes,
+                data[ training ],
+                sorted( outputs ),
+                outputs,
+                args.pair_cache,
+                store_directory = store_directory( args, next( iter( outputs.values() ) ) ),
+                result_cache = result_cache( args, next( iter( outputs.values() ) ) ),
+                pool = pool,
+                dataset = datasets[ training ],
+                **selection_options( args ) ) for training, outputs in cv_groups.items() ]
+
+            running += [ drivers.submit( validation_job, pool, args, panel_size, datasets[ training ], datasets[ validation ], data[ training ], data[ validation ], output )
+                for training, validation, panel_size, output in jobs if validation is not None ]
+
+            for job in running:
+                job.result()
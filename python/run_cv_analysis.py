@@ -2,22 +2,119 @@
 """
 Run cross-validation analysis
 
+Usage: run_cv_analysis.py training.csv panel_sizes output [options]
+
+panel_sizes is one size or a comma separated list (e.g. 2,3,4,5). With several
+sizes all of them are evaluated in one outer LOO, and output must contain {}
+which is replaced by each panel size (e.g. roc_cv_q1_p{}.cols). Outputs ending
+in .cols are written in the columnar format (see result_format.py), others are
+pickled.
+
+Options select how the inner panel/method selection is run (see
+analysis_pipeline.select_panel_method); run with -h for the list. By default
+selection is exhaustive inner LOO over all candidates.
+
+Finished folds are stored as they complete (by default in fold-store/ next to
+the output), so a run that is interrupted and restarted with the same data,
+options and code only computes the missing folds. Finished results are also kept in a
+content-addressed cache (by default result-cache/ next to the output; see
+result_cache.py), so rerunning with identical data, options and code is
+instant.
+
 @author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
 """
 
-from sys import argv
-from pandas import read_csv
-from analysis_pipeline import run_analysis_pipeline
+import os
+import sys
+import secrets
+from argparse import ArgumentParser
+from result_cache import ResultCache
+from distributed import parse_address
+from analysis_pipeline import run_analysis_pipeline_sizes
+
+def add_selection_arguments( parser ):
+    """Options of the inner panel/method selection and of how the folds run."""
+    parser.add_argument( '--selection', choices = [ 'exhaustive', 'prune', 'halving' ], default = 'exhaustive',
+        help = 'exhaustive inner LOO, exhaustive with pruning, or approximate successive halving' )
+    parser.add_argument( '--halving-folds', type = int, default = 3, help = 'stratified folds of the first halving round' )
+    parser.add_argument( '--halving-eta', type = int, default = 3, help = 'keep 1/eta of candidates per halving round' )
+    parser.add_argument( '--C-bisection', action = 'store_true',
+        help = 'find L1 panels by bisecting the C path instead of fitting every C (approximate, can miss panels)' )
+    parser.add_argument( '--scoring', choices = [ 'probability', 'ranking' ], default = 'probability' )
+    parser.add_argument( '--closed-form-nb', action = 'store_true' )
+    parser.add_argument( '--warm-start-linear', action = 'store_true',
+        help = 'warm-started lbfgs for lr (only faster on panels wider than about 5) and, with --scoring ranking, support-vector-only refits for lsvc' )
+    parser.add_argument( '--precomputed-kernel', action = 'store_true' )
+    parser.add_argument( '--pair-cache', action = 'store_true' )
+    parser.add_argument( '--processes', type = int, default = None, help = 'workers (default: all cores)' )
+    parser.add_argument( '--backend', choices = [ 'process', 'thread', 'distributed' ], default = 'process',
+        help = 'run workers as processes, threads, or distributed.py workers connecting to --coordinator' )
+    parser.add_argument( '--coordinator', default = 'localhost:6000', help = 'host:port to listen on for distributed workers' )
+    parser.add_argument( '--authkey', default = os.environ.get( 'PANEL_AUTHKEY', '' ), help = 'authkey of distributed workers (default: $PANEL_AUTHKEY, or a new random key that is printed)' )
+    parser.add_argument( '--lease-timeout', type = float, default = None, help = 'seconds after which a distributed task is handed out again' )
+    parser.add_argument( '--max-attempts', type = int, default = 3, help = 'workers a distributed task may lose before it fails' )
+    parser.add_argument( '--store', default = None, help = 'directory of finished folds (default: fold-store next to the output)' )
+    parser.add_argument( '--no-store', action = 'store_true', help = 'do not store finished folds' )
+    parser.add_argument( '--cache', default = None, help = 'result cache directory (default: result-cache next to the output)' )
+    parser.add_argument( '--cache-max-bytes', type = int, default = None, help = 'evict least recently used results beyond this size' )
+    parser.add_argument( '--no-cache', action = 'store_true', help = 'do not use the result cache' )
+
+def selection_options( args ):
+    return ( {
+        'C_bisection': args.C_bisection,
+        'scoring': args.scoring,
+        'closed_form_nb': args.closed_form_nb,
+        'warm_start_linear': args.warm_start_linear,
+        'precomputed_kernel': args.precomputed_kernel,
+        'prune': args.selection == 'prune',
+        'halving': args.selection == 'halving',
+        'halving_folds': args.halving_folds,
+        'halving_eta': args.halving_eta } )
+
+def coordinator_options( args ):
+    if args.backend != 'distributed':
+        return ( None )
+    if not args.authkey:
+        args.authkey = secrets.token_hex( 16 )
+        print( 'No --authkey or PANEL_AUTHKEY given, start the workers with --authkey {}'.format( args.authkey ), file = sys.stderr )
+    return ( { 'address': parse_address( args.coordinator ), 'authkey': args.authkey.encode(), 'lease_timeout': args.lease_timeout, 'max_attempts': args.max_attempts } )
+
+def store_directory( args, output_filename ):
+    if args.no_store:
+        return ( None )
+    return ( args.store or os.path.join( os.path.dirname( output_filename ), 'fold-store' ) )
+
+def result_cache( args, output_filename ):
+    if args.no_cache:
+        return ( None )
+    return ( ResultCache( args.cache or os.path.join( os.path.dirname( output_filename ), 'result-cache' ), args.cache_max_bytes ) )
 
 if __name__ == '__main__':
 
-    training_filename = argv[1]
-    panel_size = int(argv[2])
-    pickled_filename = argv[3]
-    
-    data = read_csv(training_filename)
-    result = run_analysis_pipeline(
+    from pandas import read_csv
+
+    parser = ArgumentParser( description = 'Run cross-validation analysis' )
+    parser.add_argument( 'training_filename' )
+    parser.add_argument( 'panel_sizes' )
+    parser.add_argument( 'output_filename' )
+    add_selection_arguments( parser )
+    args = parser.parse_args()
+
+    panel_sizes = [ int( size ) for size in args.panel_sizes.split(',') ]
+
+    if len( panel_sizes ) > 1 and '{}' not in args.output_filename:
+        raise ValueError( 'Output file name must contain {} when running several panel sizes' )
+
+    data = read_csv( args.training_filename )
+    result = run_analysis_pipeline_sizes(
         data = data,
-        panel_size = panel_size,
-        output_file_name = pickled_filename
-    )        
+        panel_sizes = panel_sizes,
+        output_file_names = { panel_size: args.output_filename.format( panel_size ) for panel_size in panel_sizes },
+        pair_cache = args.pair_cache,
+        processes = args.processes,
+        backend = args.backend,
+        store_directory = store_directory( args, args.output_filename ),
+        result_cache = result_cache( args, args.output_filename ),
+        coordinator = coordinator_options( args ),
+        **selection_options( args )
+    )
@@ -4,15 +4,25 @@ Created on Wed Sep  6 16:54:04 2017
 
 Validation evaluation script
 
+Usage: run_val_analysis.py training.csv validation.csv panel_size output [options]
+
+The output is written in the columnar format if its name ends in .cols (see
+result_format.py), and pickled otherwise.
+
+The result is kept in a content-addressed cache (by default result-cache/ next
+to the output; see result_cache.py), so rerunning with identical data, options
+and code is instant.
+
 @author: yuriy
 """
 
+import os
 import analysis_pipeline
-import pandas
 import logging
-from sys import argv
-from pickle import dump
+from argparse import ArgumentParser
+import result_format
 from misc_tools import unpack
+from result_cache import ResultCache
 
 # Global constants
 logging.basicConfig( level = logging.DEBUG )
@@ -22,23 +32,34 @@ log.setLevel( logging.DEBUG )
 # Main run
 if __name__ == '__main__':
 
-    training_filename = argv[1]
-    validation_filename = argv[2]
-    panel_size = int( argv[3] )
-    pickle_filename = argv[4]
+    import pandas
+
+    parser = ArgumentParser( description = 'Validation evaluation' )
+    parser.add_argument( 'training_filename' )
+    parser.add_argument( 'validation_filename' )
+    parser.add_argument( 'panel_size', type = int )
+    parser.add_argument( 'output_filename' )
+    parser.add_argument( '--cache', default = None, help = 'result cache directory (default: result-cache next to the output)' )
+    parser.add_argument( '--cache-max-bytes', type = int, default = None, help = 'evict least recently used results beyond this size' )
+    parser.add_argument( '--no-cache', action = 'store_true', help = 'do not use the result cache' )
+    args = parser.parse_args()
 
-    training_data = pandas.read_csv(training_filename)
-    validation_data = pandas.read_csv(validation_filename)
+    training_data = pandas.read_csv( args.training_filename )
+    validation_data = pandas.read_csv( args.validation_filename )
             
     train_features, train_labels, feature_labels = unpack( training_data )
     test_features, test_labels, feature_labels_test = unpack( validation_data )
     
     if feature_labels != feature_labels_test:
         log.error( "Feature labels don't match up between training and validation." )
-    
-    result = analysis_pipeline.core_pipeline( train_features, train_labels, test_features, test_labels, feature_labels, panel_size )
 
-    log.debug( 'saving pkl' )            
+    if args.no_cache:
+        result_cache = None
+    else:
+        result_cache = ResultCache( args.cache or os.path.join( os.path.dirname( args.output_filename ), 'result-cache' ), args.cache_max_bytes )
     
-    with open( pickle_filename, 'wb' ) as outfile:
-        dump( result, outfile )
\ No newline at end of file
+    result = analysis_pipeline.core_pipeline( train_features, train_labels, test_features, test_labels, feature_labels, args.panel_size, result_cache = result_cache )
+
+    log.debug( 'saving results' )
+
+    result_format.save( args.output_filename, result )
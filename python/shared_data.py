@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Read-only arrays shared with pool workers through memory-mapped files
+
+The parent saves each array once as a .npy file and starts the pool with
+attach as its initializer, so every worker maps the same pages read-only
+instead of receiving a pickled copy of the data with each task; tasks then
+only carry indices and look the arrays up with get. Several data sets can be
+attached to one pool, each published under its own dataset name.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import os
+import numpy
+
+# Arrays attached in this process, by ( dataset, name )
+attached = dict()
+
+def publish( directory, dataset = '', **arrays ):
+    """Save arrays to directory, returning the dict of paths to pass to attach.
+    The dicts of several data sets can be merged and attached together."""
+    paths = dict()
+    for name, array in arrays.items():
+        paths[ ( dataset, name ) ] = os.path.join( directory, dataset + name + '.npy' )
+        numpy.save( paths[ ( dataset, name ) ], numpy.asarray( array ) )
+    return ( paths )
+
+def attach( paths ):
+    """Pool initializer: map the published arrays read-only."""
+    for key, path in paths.items():
+        attached[ key ] = numpy.load( path, mmap_mode = 'r' )
+
+def get( *names, dataset = '' ):
+    return ( tuple( attached[ ( dataset, name ) ] for name in names ) )
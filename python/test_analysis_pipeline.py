@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of analysis_pipeline on small synthetic data
+
+Run with python -m pytest from this directory.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import numpy
+import pytest
+import analysis_pipeline
+import misc_tools as mt
+
+@pytest.fixture
+def small_forests( monkeypatch ):
+    """Forests of 10 trees, to keep the pipeline tests fast (the patch reaches
+    thread workers, not process workers)."""
+    classifiers = dict( mt.classifier_factories )
+    classifiers["rf"] = lambda: mt.estimator( 'ensemble', 'RandomForestClassifier', n_estimators = 10 )
+    classifiers["et"] = lambda: mt.estimator( 'ensemble', 'ExtraTreesClassifier', n_estimators = 10 )
+    monkeypatch.setattr( mt, 'classifier_factories', classifiers )
+    monkeypatch.setattr( mt, 'feature_selection_tree_methods', [
+        lambda: mt.estimator( 'tree', 'DecisionTreeClassifier' ),
+        lambda: mt.estimator( 'ensemble', 'RandomForestClassifier', n_estimators = 10 ),
+        lambda: mt.estimator( 'ensemble', 'ExtraTreesClassifier', n_estimators = 10 ) ] )
+
+def correlated_data( n = 40, p = 10, seed = 0 ):
+    """Features sharing a latent factor, with the labels depending on a few."""
+    rng = numpy.random.RandomState( seed )
+    latent = rng.randn( n, 1 )
+    features = latent + 0.5 * rng.randn( n, p )
+    labels = ( features[:, :3].sum( axis = 1 ) + rng.randn( n ) > 0 ).astype( int )
+    return ( features, labels )
+
+def l1_panel_function( features, labels ):
+    """The first L1 selector of get_panel_sets, with liblinear's random state fixed."""
+    normalized = mt.normalize_features( features, normal = "scaled" )
+    method = lambda C: mt.feature_selection_C_methods[0]( C ).set_params( random_state = 0 )
+    return ( lambda C: analysis_pipeline.get_C_panel( method, normalized, labels, C ) )
+
+def test_C_path_fits_every_C_by_default():
+    features, labels = correlated_data()
+    function = l1_panel_function( features, labels )
+    C_range = analysis_pipeline.C_grid[::50]
+    assert analysis_pipeline.C_path_panels( function, C_range ) == [ frozenset( function( C ) ) for C in C_range ]
+
+def test_C_path_bisection_against_sweep():
+    features, labels = correlated_data()
+    function = l1_panel_function( features, labels )
+    sweep = analysis_pipeline.C_path_panels( function )
+    bisection = analysis_pipeline.C_path_panels( function, bisection = True )
+    # Bisection only fits grid points of the sweep, so it can miss panels but not add any
+    assert set( bisection ) <= set( sweep )
+    # It always fits both ends of the path, and on this data misses at most one panel in four
+    assert bisection[0] == sweep[0] and bisection[-1] == sweep[-1]
+    assert len( set( bisection ) ) >= 0.75 * len( set( sweep ) )
+
+def small_data( n = 14, p = 6, seed = 0 ):
+    """Positive features (nb's final fit takes their log), the first two shifted
+    in the positive class."""
+    rng = numpy.random.RandomState( seed )
+    labels = numpy.arange( n ) % 2
+    features = numpy.exp( rng.randn( n, p ) + labels[:, numpy.newaxis] * numpy.array( [ 1., 1. ] + [ 0. ] * ( p - 2 ) ) )
+    return ( features, labels, [ 'f{}'.format( i ) for i in range( p ) ] )
+
+def same_results( a, b ):
+    return ( all( a[ panel_size ]['panel'] == b[ panel_size ]['panel'] and a[ panel_size ]['method'] == b[ panel_size ]['method']
+        and numpy.array_equal( a[ panel_size ]['score'], b[ panel_size ]['score'] )
+        and numpy.array_equal( a[ panel_size ]['inner_scores'], b[ panel_size ]['inner_scores'] ) for panel_size in a ) )
+
+def test_threaded_folds_replay_from_random_state( small_forests ):
+    from multiprocessing.pool import ThreadPool
+    features, labels, feature_labels = small_data()
+
+    def fold( i ):
+        train, test = analysis_pipeline.fold_split( len( labels ), i )
+        return ( analysis_pipeline.core_pipeline_sizes( features[train], labels[train], features[test], labels[test], feature_labels, [ 2, 3 ], prune = True ) )
+
+    with ThreadPool( 4 ) as pool:
+        results = pool.map( fold, range( 4 ) )
+
+    for i, result in enumerate( results ):
+        train, test = analysis_pipeline.fold_split( len( labels ), i )
+        replay = analysis_pipeline.core_pipeline_sizes( features[train], labels[train], features[test], labels[test], feature_labels, [ 2, 3 ],
+            random_seed = result[2]['random_state'], prune = True )
+        assert same_results( result, replay )
+
+def test_flat_folds_match_serial_replay( small_forests, tmp_path ):
+    import shared_data
+    features, labels, feature_labels = small_data()
+    shared = shared_data.publish( str( tmp_path ), features = features, labels = labels, feature_labels = feature_labels )
+    with analysis_pipeline.new_pool( 4, "thread", shared ) as pool:
+        fold_results = analysis_pipeline.flat_cv_folds( pool, labels, [ 2, 3 ], [ 0, 1, 2 ] )
+
+    for fold, result in fold_results.items():
+        train, test = analysis_pipeline.fold_split( len( labels ), fold )
+        replay = analysis_pipeline.core_pipeline_sizes( features[train], labels[train], features[test], labels[test], feature_labels, [ 2, 3 ],
+            random_seed = result[2]['random_state'] )
+        assert same_results( result, replay )
+
+def test_pruned_selection_matches_exhaustive( small_forests ):
+    features, labels, feature_labels = small_data()
+    for fold in range( 3 ):
+        train, test = analysis_pipeline.fold_split( len( labels ), fold )
+        random_seed = analysis_pipeline.new_random_seed()
+        panels = analysis_pipeline.get_panel_set( features[train], labels[train], 2, random_state = analysis_pipeline.task_seed( random_seed, 'panels' ) )
+        exhaustive = analysis_pipeline.select_panel_method( features[train], labels[train], features[test], panels, random_seed = random_seed )
+        pruned = analysis_pipeline.select_panel_method( features[train], labels[train], features[test], panels, random_seed = random_seed, prune = True )
+        assert exhaustive[:2] == pruned[:2]
+        assert numpy.array_equal( exhaustive[2], pruned[2] )
+        # Every candidate is refit per fold, and has a proxy fit
+        n_candidates = len( panels ) * len( mt.classifier_factories )
+        assert pruned[4]['exhaustive_fits'] == len( train ) * n_candidates
+        assert n_candidates < pruned[4]['fits'] <= pruned[4]['exhaustive_fits'] + n_candidates
+
+def test_cv_results_resume_after_crash( small_forests, tmp_path, monkeypatch ):
+    from fold_store import FoldStore
+    features, labels, feature_labels = small_data( n = 8 )
+    store_directory = str( tmp_path / 'fold-store' )
+
+    # Crash after two folds are stored
+    append = FoldStore.append
+    def crashing_append( store, fold, result ):
+        if len( store.load() ) == 2:
+            raise KeyboardInterrupt
+        append( store, fold, result )
+    monkeypatch.setattr( FoldStore, 'append', crashing_append )
+    with pytest.raises( KeyboardInterrupt ):
+        analysis_pipeline.cv_results( features, labels, feature_labels, [ 2 ], processes = 2, backend = "thread", store_directory = store_directory )
+    monkeypatch.setattr( FoldStore, 'append', append )
+
+    stored = FoldStore( store_directory, analysis_pipeline.run_key( features, labels, feature_labels, [ 2 ], dict() ) ).load()
+    assert len( stored ) == 2
+
+    # The restart only runs the missing folds, and keeps the stored ones
+    pool_cv_folds = analysis_pipeline.pool_cv_folds
+    run_folds = []
+    def recording_pool_cv_folds( pool, labels, panel_sizes, folds, *args, **kwargs ):
+        run_folds.extend( folds )
+        return ( pool_cv_folds( pool, labels, panel_sizes, folds, *args, **kwargs ) )
+    monkeypatch.setattr( analysis_pipeline, 'pool_cv_folds', recording_pool_cv_folds )
+    results = analysis_pipeline.cv_results( features, labels, feature_labels, [ 2 ], processes = 2, backend = "thread", store_directory = store_directory )
+
+    assert sorted( run_folds ) == sorted( set( range( len( labels ) ) ) - set( stored ) )
+    assert len( results[2] ) == len( labels )
+    for fold, result in stored.items():
+        assert same_results( result, { 2: results[2][ fold ] } )
+
+@pytest.mark.parametrize( 'method', [ 'lr', 'nb', 'lsvc' ] )
+def test_pair_cache_scores_match_refitting( tmp_path, method ):
+    from pair_cache import PairFitCache
+    features, labels, feature_labels = small_data( n = 10 )
+    panel = [ 0, 2, 3 ]
+    # One cache for both scorings, so ranking scores must not be read as probabilities
+    fit_cache = PairFitCache( str( tmp_path ), len( labels ) )
+    hits = []
+    get = fit_cache.get
+    def counting_get( *args ):
+        record = get( *args )
+        hits.append( record is not None )
+        return ( record )
+    fit_cache.get = counting_get
+
+    # Outer folds in order, so each reads the records of the folds before it
+    for fold in range( len( labels ) ):
+        train, test = analysis_pipeline.fold_split( len( labels ), fold )
+        for scoring in [ 'probability', 'ranking' ]:
+            cached = analysis_pipeline.candidate_loo_scores( features[train], labels[train], features[test], panel, method, fit_cache, train, fold, scoring = scoring )
+            refit = analysis_pipeline.candidate_loo_scores( features[train], labels[train], features[test], panel, method, scoring = scoring )
+            assert numpy.array_equal( cached, refit )
+    assert any( hits )
+
+def test_pair_cache_selections_match_refitting( tmp_path, monkeypatch ):
+    from pair_cache import PairFitCache
+    monkeypatch.setattr( mt, 'classifier_factories', { method: mt.classifier_factories[ method ] for method in [ 'lr', 'lsvc', 'nb' ] } )
+    features, labels, feature_labels = small_data( n = 10 )
+    panels = [ [ 0, 1 ], [ 0, 2, 3 ], [ 4, 5 ] ]
+    fit_cache = PairFitCache( str( tmp_path ), len( labels ) )
+    for fold in range( len( labels ) ):
+        train, test = analysis_pipeline.fold_split( len( labels ), fold )
+        cached = analysis_pipeline.select_panel_method( features[train], labels[train], features[test], panels, fit_cache, train, fold )
+        refit = analysis_pipeline.select_panel_method( features[train], labels[train], features[test], panels )
+        assert cached[:2] == refit[:2]
+        assert numpy.array_equal( cached[2], refit[2] )
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the distributed backend, with a coordinator and workers on localhost
+
+Run with python -m pytest from this directory.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import os
+import pytest
+import distributed
+from multiprocessing import Process
+
+authkey = b'test'
+
+def square( x ):
+    return ( x * x )
+
+def crash_once( marker ):
+    """Takes its worker down the first time it runs, then returns the number of runs."""
+    with open( marker, 'a' ) as outfile:
+        outfile.write( 'run\n' )
+    with open( marker ) as infile:
+        runs = len( infile.readlines() )
+    if runs == 1:
+        os._exit( 1 )
+    return ( runs )
+
+def crash( marker ):
+    with open( marker, 'a' ) as outfile:
+        outfile.write( 'run\n' )
+    os._exit( 1 )
+
+@pytest.fixture
+def coordinator():
+    coordinator = distributed.Coordinator( ( 'localhost', 0 ), authkey, max_attempts = 2 )
+    workers = [ Process( target = distributed.run_worker, args = ( coordinator.listener.address, authkey ) ) for i in range( 3 ) ]
+    for worker in workers:
+        worker.start()
+    yield ( coordinator )
+    coordinator.close()
+    for worker in workers:
+        worker.join( timeout = 10 )
+        if worker.is_alive():
+            worker.terminate()
+
+def test_tasks_run_on_workers( coordinator ):
+    assert sorted( coordinator.imap_unordered( square, range( 20 ) ) ) == [ x * x for x in range( 20 ) ]
+    assert coordinator.apply_async( square, ( 7, ) ).result( timeout = 30 ) == 49
+
+def test_task_of_a_lost_worker_is_requeued( coordinator, tmp_path ):
+    marker = str( tmp_path / 'runs' )
+    future = coordinator.apply_async( crash_once, ( marker, ) )
+    resolved = []
+    future.add_done_callback( resolved.append )
+    assert future.result( timeout = 30 ) == 2
+    # The other workers still take tasks, and the future was resolved once
+    assert sorted( coordinator.imap_unordered( square, range( 10 ) ) ) == [ x * x for x in range( 10 ) ]
+    assert resolved == [ future ]
+
+def test_task_fails_after_losing_max_attempts_workers( coordinator, tmp_path ):
+    marker = str( tmp_path / 'runs' )
+    with pytest.raises( RuntimeError ):
+        coordinator.apply_async( crash, ( marker, ) ).result( timeout = 30 )
+    with open( marker ) as infile:
+        assert len( infile.readlines() ) == 2
+    # The one worker left runs the remaining tasks
+    assert sorted( coordinator.imap_unordered( square, range( 10 ) ) ) == [ x * x for x in range( 10 ) ]
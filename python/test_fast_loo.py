@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the fast_loo engines against refitting every fold
+
+Run with python -m pytest from this directory.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import numpy
+import pytest
+import fast_loo
+import analysis_pipeline
+import misc_tools as mt
+
+def test_gaussian_nb_loo_scores_match_refitting():
+    rng = numpy.random.RandomState( 0 )
+    labels = numpy.arange( 20 ) % 2
+    features = rng.randn( 20, 5 ) + labels[:, numpy.newaxis]
+    features[ rng.rand( 20, 5 ) < 0.2 ] = numpy.nan
+    # Column 4 is observed in one row only, so the fold holding it out drops the column
+    features[:, 4] = numpy.nan
+    features[3, 4] = 1.
+    panels = [ [ 0, 1 ], [ 2, 3 ], [ 1, 4 ] ]
+    scores = fast_loo.gaussian_nb_loo_scores( features, labels, panels )
+    for c, panel in enumerate( panels ):
+        refit = analysis_pipeline.inner_loo_scores( features[:, panel], labels, mt.classifier_factories["nb"]() )
+        assert numpy.allclose( scores[:, c], refit, rtol = 1e-10, atol = 1e-12 )
+
+def test_gaussian_nb_loo_scores_need_two_samples_per_class():
+    features = numpy.random.RandomState( 0 ).randn( 6, 2 )
+    with pytest.raises( ValueError ):
+        fast_loo.gaussian_nb_loo_scores( features, numpy.array( [ 0, 0, 0, 0, 0, 1 ] ), [ [ 0, 1 ] ] )
+
+def test_linear_svc_loo_scores_match_refitting():
+    rng = numpy.random.RandomState( 0 )
+    features = rng.randn( 30, 3 )
+    labels = ( features[:,0] + 0.5 * rng.randn( 30 ) > 0 ).astype( int )
+    # Reused folds agree to libsvm's tolerance; without ranking every fold is refit
+    for scoring, atol in [ ( "ranking", 1e-3 ), ( "probability", 0 ) ]:
+        classifier, ranking = analysis_pipeline.candidate_classifier( "lsvc", scoring )
+        refit = analysis_pipeline.inner_loo_scores( features, labels, classifier, ranking )
+        assert numpy.allclose( fast_loo.linear_svc_loo_scores( features, labels, classifier, ranking ), refit, rtol = 0, atol = atol )
+
+def test_precomputed_svm_loo_scores_match_refitting():
+    rng = numpy.random.RandomState( 0 )
+    features = rng.randn( 30, 3 )
+    labels = ( features[:,0] + 0.5 * rng.randn( 30 ) > 0 ).astype( int )
+    # Without missing values only the rounding of the kernel arithmetic differs from refitting
+    for method, gamma in [ ( "lsvc", None ), ( "rbfsvc", "scale" ), ( "rbfsvc", "auto" ), ( "rbfsvc", 0.3 ) ]:
+        for scoring in [ "ranking", "probability" ]:
+            classifier, ranking = analysis_pipeline.candidate_classifier( method, scoring )
+            if gamma is not None:
+                classifier.set_params( gamma = gamma )
+            refit = analysis_pipeline.inner_loo_scores( features, labels, classifier, ranking )
+            assert numpy.allclose( fast_loo.precomputed_svm_loo_scores( features, labels, classifier, ranking ), refit, rtol = 0, atol = 1e-12 )
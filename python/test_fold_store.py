@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the append-only fold store
+
+Run with python -m pytest from this directory.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import os
+from fold_store import FoldStore
+
+def test_load_drops_record_cut_short( tmp_path ):
+    store = FoldStore( str( tmp_path ), 'run' )
+    for fold in range( 3 ):
+        store.append( fold, { 'fold': fold } )
+    with open( store.path, 'ab' ) as outfile:
+        outfile.write( b'\x80\x04\x95partial' )
+
+    assert store.load() == { fold: { 'fold': fold } for fold in range( 3 ) }
+
+    # The partial record is cut off, so new folds follow the last good one
+    store.append( 3, { 'fold': 3 } )
+    assert store.load() == { fold: { 'fold': fold } for fold in range( 4 ) }
+
+def test_remove( tmp_path ):
+    store = FoldStore( str( tmp_path ), 'run' )
+    store.append( 0, 'result' )
+    store.remove()
+    assert not os.path.exists( store.path )
+    assert store.load() == dict()
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""
+Import-time budget of the command line scripts (see check_import_time)
+
+Run with python -m pytest from this directory.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import pytest
+import check_import_time
+
+@pytest.mark.parametrize( 'module', sorted( check_import_time.budgets ) )
+def test_import_time_budget( module ):
+    time_ms, numpy_ms, heavy = check_import_time.check( module )
+    assert heavy == []
+    assert time_ms <= check_import_time.budgets[ module ] * numpy_ms
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the content-addressed result cache
+
+Run with python -m pytest from this directory.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import os
+import pytest
+from result_cache import ResultCache
+
+def test_put_then_get( tmp_path ):
+    cache = ResultCache( str( tmp_path ) )
+    key = cache.key( 'data', 5 )
+    assert cache.get( key ) is None
+    cache.put( key, { 'score': [ 1, 2 ] }, 'p5' )
+    assert cache.get( key ) == { 'score': [ 1, 2 ] }
+    assert [ ( entry[0], entry[3] ) for entry in cache.entries() ] == [ ( key, 'p5' ) ]
+
+def test_interrupted_put_is_a_miss( tmp_path, monkeypatch ):
+    import pickle
+    cache = ResultCache( str( tmp_path ) )
+    key = cache.key( 'data', 5 )
+
+    # Crash while writing the pickle, after the description is written
+    def crashing_dump( result, outfile ):
+        raise KeyboardInterrupt
+    monkeypatch.setattr( pickle, 'dump', crashing_dump )
+    with pytest.raises( KeyboardInterrupt ):
+        cache.put( key, 'result' )
+    monkeypatch.undo()
+
+    assert cache.get( key ) is None
+    assert cache.entries() == []
+    cache.put( key, 'result' )
+    assert cache.get( key ) == 'result'
+
+def test_pickle_without_description_is_a_miss( tmp_path ):
+    cache = ResultCache( str( tmp_path ) )
+    key = cache.key( 'data', 5 )
+    cache.put( key, 'result' )
+    os.remove( cache.path( key, '.json' ) )
+    assert cache.get( key ) is None
+    assert not os.path.exists( cache.path( key, '.pkl' ) )
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the columnar result format
+
+Run with python -m pytest from this directory.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import os
+import numpy
+import result_format
+
+def fold_result( rng, n_test, n_inner, panel, method ):
+    """A result shaped as analysis_pipeline.final_model_result makes them."""
+    return ( {
+        'panel': panel,
+        'method': method,
+        'score': rng.rand( n_test ),
+        'label': rng.randint( 0, 2, n_test ),
+        'inner_scores': rng.rand( n_inner, 1 ),
+        'inner_labels': rng.randint( 0, 2, ( n_inner, 1 ) ).astype( float ),
+        'random_state': numpy.random.RandomState( rng.randint( 1000 ) ).get_state(),
+        'scoring': 'probability',
+        'fits': int( rng.randint( 100 ) ) } )
+
+def assert_same_result( a, b ):
+    assert sorted( a ) == sorted( b )
+    for name in a:
+        if name == 'random_state':
+            assert a[ name ][0] == b[ name ][0] and numpy.array_equal( a[ name ][1], b[ name ][1] ) and a[ name ][2:] == b[ name ][2:]
+        elif isinstance( a[ name ], numpy.ndarray ):
+            assert a[ name ].dtype == b[ name ].dtype and numpy.array_equal( a[ name ], b[ name ] )
+        else:
+            assert a[ name ] == b[ name ]
+
+def test_cv_results_round_trip( tmp_path ):
+    rng = numpy.random.RandomState( 0 )
+    results = [ fold_result( rng, 1, 9, [ 'a', 'b' ] if i % 2 else [ 'c', 'a' ], [ 'lr', 'rf', 'nb' ][ i % 3 ] ) for i in range( 10 ) ]
+    path = str( tmp_path / 'cv.cols' )
+    result_format.save( path, results )
+    loaded = result_format.load( path )
+    assert len( loaded ) == len( results )
+    for result, loaded_result in zip( results, loaded ):
+        assert_same_result( result, loaded_result )
+
+def test_validation_result_round_trip( tmp_path ):
+    result = fold_result( numpy.random.RandomState( 1 ), 7, 20, [ 'a', 'b', 'c' ], 'et' )
+    path = str( tmp_path / 'validation.cols' )
+    result_format.save( path, result )
+    assert_same_result( result, result_format.load( path ) )
+
+def test_rewrite_replaces_result_set( tmp_path ):
+    rng = numpy.random.RandomState( 2 )
+    path = str( tmp_path / 'cv.cols' )
+    result_format.save( path, [ fold_result( rng, 1, 4, [ 'a' ], 'lr' ) for i in range( 5 ) ] )
+    results = [ fold_result( rng, 1, 4, [ 'b' ], 'dt' ) for i in range( 5 ) ]
+    for result in results:
+        del result['fits']
+    result_format.save( path, results )
+
+    # No stale columns of the old results, and no temporary directories left
+    assert not os.path.exists( os.path.join( path, 'fits.npy' ) )
+    assert os.listdir( str( tmp_path ) ) == [ 'cv.cols' ]
+    for result, loaded_result in zip( results, result_format.load( path ) ):
+        assert_same_result( result, loaded_result )
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of roc_ci: the vectorized implementations against the loops they replace
+
+Run with python -m pytest from this directory.
+
+@author: Yuriy Sverchkov (yuriy.sverchkov@wisc.edu)
+"""
+
+import numpy as np
+from roc_ci import (
+    rocstats, rocstats_loop, roc_stats_from_counts, roc_stats_from_counts_loop, max_tpr_at_fpr, boundary_matrix,
+    roc_surfaces, confidence_blob, confidence_blobs, confidence_blob_loop, iter_roc_surfaces, get_hull_from_blob,
+    get_hull_from_blob_loop, SurfaceBlock )
+
+def test_rocstats_matches_loop():
+    rng = np.random.RandomState( 0 )
+    for scores, labels in [
+        ( [0.1, 0.2, 0.7, 0.4, 0.5, 0.8, 0.7, 0.9], [0, 0, 0, 0, 1, 1, 1, 1] ), # tied
+        ( rng.rand( 200 ), rng.rand( 200 ) < 0.4 ), # untied
+        ( rng.randint( 0, 10, 200 ) / 10, rng.rand( 200 ) < 0.4 ) # heavily tied
+    ]:
+        assert all( np.array_equal( v, l ) for v, l in zip( rocstats( scores, labels ), rocstats_loop( scores, labels ) ) )
+
+def test_roc_stats_from_counts_matches_loop():
+    positives = [132, 85, 63, 53, 15]
+    negatives = [19, 50, 48, 151, 92]
+    assert all( np.array_equal( v, l ) for v, l in zip( roc_stats_from_counts( positives, negatives ), roc_stats_from_counts_loop( positives, negatives ) ) )
+
+def test_max_tpr_at_fpr_matches_rocstats():
+    rng = np.random.RandomState( 0 )
+    labels = rng.rand( 100 ) < 0.4
+    score_matrix = np.column_stack( [ rng.rand( 100 ), rng.randint( 0, 5, 100 ), labels + rng.rand( 100 ) ] )
+    best, pauc = max_tpr_at_fpr( score_matrix, labels, 0.2, partial_auc = True )
+    for j in range( score_matrix.shape[1] ):
+        tp, fp, fn, tn = rocstats( score_matrix[:,j], labels )
+        tpr = np.divide( tp, np.add( tp, fn ) )
+        fpr = np.divide( fp, np.add( fp, tn ) )
+        assert best[j] == np.max( [tpr[i] for i in range( 0, len(tpr) ) if fpr[i] <= 0.2] )
+        x, y = fpr[::-1], tpr[::-1]
+        k = np.count_nonzero( x <= 0.2 )
+        x_k = np.append( x[:k], 0.2 )
+        y_k = np.append( y[:k], y[k-1] + ( y[k] - y[k-1] ) * ( 0.2 - x[k-1] ) / ( x[k] - x[k-1] ) )
+        assert np.isclose( pauc[j], np.sum( np.diff( x_k ) * ( y_k[1:] + y_k[:-1] ) / 2 ) )
+
+def test_boundary_matrix_matches_lgamma():
+    for a0, a1, b0, b1 in [ (0, 10, 10, 0), (3, 7, 12, 2), (40, 60, 25, 15), (130, 2, 1, 120) ]:
+        fast = boundary_matrix( a0, a1, b0, b1, 300 )
+        slow = boundary_matrix( a0, a1, b0, b1, 300, vectorized = False )
+        assert np.allclose( fast, slow, rtol = 1e-6, atol = 1e-12 )
+
+def test_confidence_blob_matches_loop():
+    tp, fp, fn, tn = roc_stats_from_counts( [132, 85, 63, 53, 15], [19, 50, 48, 151, 92] )
+    surfaces = roc_surfaces( tp, fp, fn, tn, 100 )
+    surfaces.append( np.asmatrix( np.ones( (20, 30) ) / 600 ) ) # all cells tied
+    for surface in surfaces:
+        assert np.array_equal( confidence_blob( surface ), confidence_blob_loop( surface ) )
+    assert np.array_equal( confidence_blobs( np.stack( [ np.asarray( s ) for s in surfaces[:-1] ] ) ), [ confidence_blob_loop( s ) for s in surfaces[:-1] ] )
+
+def hull_vertices( hull ):
+    """The vertices of a hull as (x, y) rows in lexicographic order."""
+    vertices = hull.points[ hull.vertices ]
+    return ( vertices[ np.lexsort( ( vertices[:,1], vertices[:,0] ) ) ] )
+
+def same_hull( a, b ):
+    a_vertices, b_vertices = hull_vertices( a ), hull_vertices( b )
+    return ( a_vertices.shape == b_vertices.shape and np.allclose( a_vertices, b_vertices ) and np.isclose( a.volume, b.volume ) )
+
+def test_same_hull_keeps_vertex_pairing():
+    from scipy.spatial import ConvexHull
+    # Same x and y coordinate sets, different hulls
+    a = ConvexHull( np.array( [ (0, 0), (1, 0), (1, 2), (0, 1) ] ) )
+    b = ConvexHull( np.array( [ (0, 0), (1, 0), (1, 1), (0, 2) ] ) )
+    assert same_hull( a, a ) and not same_hull( a, b )
+
+def test_adaptive_surfaces_give_full_surface_hulls():
+    tp, fp, fn, tn = roc_stats_from_counts( [132, 85, 63, 53, 15], [19, 50, 48, 151, 92] )
+    for full, block in zip( iter_roc_surfaces( tp, fp, fn, tn, 300 ), iter_roc_surfaces( tp, fp, fn, tn, 300, adaptive = True ) ):
+        full_hull = get_hull_from_blob( confidence_blob( full ) )
+        block_hull = get_hull_from_blob( confidence_blob( block ) )
+        assert same_hull( full_hull, block_hull )
+
+def test_hull_from_blob_matches_loop():
+    tp, fp, fn, tn = roc_stats_from_counts( [132, 85, 63, 53, 15], [19, 50, 48, 151, 92] )
+    for surface in iter_roc_surfaces( tp, fp, fn, tn, 100 ):
+        blob = confidence_blob( surface )
+        assert same_hull( get_hull_from_blob( blob ), get_hull_from_blob_loop( blob ) )
+
+def test_hull_from_blob_on_non_square_grids():
+    from scipy.spatial import ConvexHull
+    # Every corner of every True cell, rows on y, columns on x
+    rng = np.random.RandomState( 0 )
+    for m, n in [ (20, 50), (50, 20), (1, 7), (7, 1) ]:
+        blob = rng.rand( m, n ) < 0.1
+        blob[0,0] = blob[-1,-1] = True
+        rows, cols = np.nonzero( blob )
+        corners = [ ( ( c + dx ) / n, ( r + dy ) / m ) for r, c in zip( rows, cols ) for dx in (0, 1) for dy in (0, 1) ]
+        assert same_hull( get_hull_from_blob( blob ), ConvexHull( np.array( corners ) ) )
+        block = SurfaceBlock( blob, 3, 5, ( m + 10, n + 10 ) )
+        corners = [ ( ( c + 5 + dx ) / ( n + 10 ), ( r + 3 + dy ) / ( m + 10 ) ) for r, c in zip( rows, cols ) for dx in (0, 1) for dy in (0, 1) ]
+        assert same_hull( get_hull_from_blob( block ), ConvexHull( np.array( corners ) ) )